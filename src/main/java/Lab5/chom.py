@@ -1,255 +1,755 @@
+import argparse
+import copy
 import itertools
+import json
+import os
+import random
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+EPSILON = "ε"
 
 
 class Chomsky:
-    def __init__(self, Vn, Vt, P, S):
-        self.Vn = Vn
-        self.Vt = Vt
+    # "classic" removes ε-rules first, which for a rule of n nullable symbols
+    # makes 2^n variants. "bin-first" splits long rules into pairs before that
+    # (the BIN-before-DEL order), so every rule has at most 4 variants.
+    ORDERS = ("classic", "bin-first")
+
+    def __init__(self, Vn, Vt, P, S, verbose=False):
+        # Symbols are interned to integer ids and every right-hand side is a
+        # tuple of ids, the empty tuple standing for ε. Vn, Vt and P_dictionary
+        # are rebuilt from these on access.
+        #
+        # P is either the "S->bA|AC, A->..." string or a dict from a left side
+        # to its rules, each rule being a string like "bA" or a sequence of
+        # symbol names (empty for ε). Vt=None takes every symbol outside Vn as
+        # a terminal. With verbose=True the grammar is printed after each step.
+        self.verbose = verbose
+        self.symbols = []
+        self.symbol_ids = {}
+        self.nonterminals = {self.intern(symbol) for symbol in Vn}
+        self.terminals = {self.intern(symbol) for symbol in Vt or ()}
         self.P = P
-        self.P_dictionary = {}
         self.S = S
+        self.start = self.intern(S)
+        self.productions = {}
         self.rules = {}
-
-        pairs = self.P.split(", ")
-        for pair in pairs:
-            a, b = pair.split("->")
-            if "|" in b:
-                rules = b.split("|")
-            else:
-                rules = [b]
-
-            rules_with_spaces = [' '.join(rule) for rule in rules]
-
-            if a in self.P_dictionary:
-                self.P_dictionary[a].extend(rules_with_spaces)
+        self.in_cnf = False
+        self.fresh_counter = 0
+        self.timings = {}
+        self.cyk_tables = None
+        self.cyk_arrays = None
+        self.earley_tables = None
+
+        if isinstance(P, str):
+            for pair in P.split(", "):
+                a, b = pair.split("->")
+                self.add_rules(a, b)
+        else:
+            for a, b in P.items():
+                self.add_rules(a, b)
+
+        if Vt is None:
+            self.terminals = {symbol for rights in self.productions.values() for rule in rights
+                              for symbol in rule if symbol not in self.nonterminals}
+
+        # The grammar as given, for the Earley recognizer; the converted
+        # grammar keeps these too
+        self.original_productions = {left: list(rights) for left, rights in self.productions.items()}
+        self.original_nonterminals = frozenset(self.nonterminals)
+
+        self.report("\nInitial production rules:")
+
+    @classmethod
+    def from_productions(cls, productions, S="S", verbose=False):
+        # Vn is the left sides, Vt every other symbol used in the rules;
+        # productions is a dict or a "S->bA|AC, ..." string
+        if isinstance(productions, str):
+            Vn = [pair.split("->")[0] for pair in productions.split(", ")]
+        else:
+            Vn = list(productions)
+        return cls(Vn, None, productions, S, verbose)
+
+    def add_rules(self, left, rules):
+        if isinstance(rules, str):
+            rules = rules.split("|")
+        left = self.intern(left)
+        if left not in self.productions:
+            self.productions[left] = []
+        for rule in rules:
+            if isinstance(rule, str):
+                self.productions[left].append(self.parse_rule(rule))
             else:
-                self.P_dictionary[a] = rules_with_spaces
-
-        print("\nInitial production rules:")
-        print(self.display_P_dictionary(self.P_dictionary))
+                self.productions[left].append(tuple(self.intern(symbol) for symbol in rule))
+
+    def copy(self):
+        # A grammar with its own symbols and rules, so converting it leaves
+        # this one as it was
+        grammar = copy.copy(self)
+        grammar.symbols = list(self.symbols)
+        grammar.symbol_ids = dict(self.symbol_ids)
+        grammar.nonterminals = set(self.nonterminals)
+        grammar.terminals = set(self.terminals)
+        grammar.productions = {left: list(rights) for left, rights in self.productions.items()}
+        grammar.rules = dict(self.rules)
+        return grammar
+
+    def report(self, title):
+        # Formatting the whole grammar is only worth it when someone reads it
+        if self.verbose:
+            print(title)
+            print(self)
+
+    def __str__(self):
+        return self.display_P_dictionary(self.P_dictionary)
+
+    def intern(self, symbol):
+        symbol_id = self.symbol_ids.get(symbol)
+        if symbol_id is None:
+            symbol_id = self.symbol_ids[symbol] = len(self.symbols)
+            self.symbols.append(symbol)
+        return symbol_id
+
+    def parse_rule(self, rule):
+        # Every character is a symbol, as in "AbAa"
+        if rule == EPSILON:
+            return ()
+        return tuple(self.intern(symbol) for symbol in rule if not symbol.isspace())
+
+    def fresh(self, prefix):
+        # A new nonterminal whose name is not used by any symbol yet
+        while True:
+            name = f"{prefix}{self.fresh_counter}"
+            self.fresh_counter += 1
+            if name not in self.symbol_ids:
+                symbol = self.intern(name)
+                self.nonterminals.add(symbol)
+                return symbol
+
+    def rule_text(self, rule):
+        if not rule:
+            return EPSILON
+        return " ".join(self.symbols[symbol] for symbol in rule)
+
+    @property
+    def Vn(self):
+        # Ids grow in order of appearance, so this keeps the order Vn was given in
+        return [self.symbols[symbol] for symbol in sorted(self.nonterminals)]
+
+    @property
+    def Vt(self):
+        return [self.symbols[symbol] for symbol in sorted(self.terminals)]
+
+    @property
+    def P_dictionary(self):
+        return {self.symbols[left]: [self.rule_text(rule) for rule in rights]
+                for left, rights in self.productions.items()}
+
+    def derivable(self, known, productions=None):
+        # Left sides that derive a string made only of `known` symbols (nothing
+        # for nullable, terminals for productive). Each rule counts the symbols
+        # it still waits for; a reverse index from symbol to the rules using it
+        # lets every newly found left side update only those rules, so the whole
+        # run is linear in the size of the grammar.
+        rule_lefts = []
+        waiting = []
+        occurrences = {}
+        found = set()
+        worklist = []
+
+        if productions is None:
+            productions = self.productions
+        for left, rights in productions.items():
+            for rule in rights:
+                index = len(rule_lefts)
+                rule_lefts.append(left)
+                count = 0
+                for symbol in rule:
+                    if symbol not in known:
+                        count += 1
+                        occurrences.setdefault(symbol, []).append(index)
+                waiting.append(count)
+                if count == 0 and left not in found:
+                    found.add(left)
+                    worklist.append(left)
+
+        while worklist:
+            symbol = worklist.pop()
+            for index in occurrences.get(symbol, ()):
+                waiting[index] -= 1
+                if waiting[index] == 0:
+                    left = rule_lefts[index]
+                    if left not in found:
+                        found.add(left)
+                        worklist.append(left)
+
+        return found
+
+    def binarize_long_rules(self):
+        # Every rule longer than two symbols becomes a chain of pairs
+        suffixes = {}
+        for left in list(self.productions.keys()):
+            self.productions[left] = [self.split_rule(rule, suffixes, "X") if len(rule) > 2 else rule
+                                      for rule in self.productions[left]]
+
+        self.report("\nStep 0: Split rules longer than two symbols:")
+
+    def split_rule(self, rule, suffixes, prefix):
+        # A -> X1 X2 ... Xk becomes A -> X1 R1, R1 -> X2 R2, ..., with one
+        # nonterminal per distinct suffix, shared by every rule ending in it
+        rest = rule[-1]
+        for symbol in reversed(rule[1:-1]):
+            pair = (symbol, rest)
+            rest = suffixes.get(pair)
+            if rest is None:
+                rest = suffixes[pair] = self.fresh(prefix)
+                self.productions[rest] = [pair]
+        return (rule[0], rest)
+
+    def drop_nullable(self, rule, nullable):
+        # Every way of leaving out nullable symbols, generated lazily: a rule
+        # with n nullable symbols has 2^n of them
+        positions = [i for i, symbol in enumerate(rule) if symbol in nullable]
+        for r in range(len(positions) + 1):
+            for combo in itertools.combinations(positions, r):
+                removed = set(combo)
+                yield tuple(symbol for i, symbol in enumerate(rule) if i not in removed)
 
     def eliminate_epsilons(self):
-        print("\nStep 1: Eliminated ε-productions:")
-        nullable = set()
-
-        changed = True
-        while changed:
-            changed = False
-            for left, rights in self.P_dictionary.items():
-                for rule in rights:
-                    if rule == "ε" or all(symbol in nullable for symbol in rule.split()):
-                        if left not in nullable:
-                            nullable.add(left)
-                            changed = True
-
-        new_P_dict = {}
-        for left, rights in self.P_dictionary.items():
-            new_rules = set()
+        nullable = self.derivable(set())
+
+        new_productions = {}
+        for left, rights in self.productions.items():
+            new_rules = {}  # used as an ordered set
             for rule in rights:
-                if rule == "ε":
+                if not rule:
+                    if left == self.start:
+                        new_rules[()] = None
                     continue
-                symbols = rule.split()
-                positions = [i for i, sym in enumerate(symbols) if sym in nullable]
-
-                all_combinations = []
-                for r in range(len(positions) + 1):
-                    for combo in itertools.combinations(positions, r):
-                        all_combinations.append(combo)
-
-                for combo in all_combinations:
-                    new_rule = [symbols[i] for i in range(len(symbols)) if i not in combo]
+                for new_rule in self.drop_nullable(rule, nullable):
                     if new_rule:
-                        new_rules.add(" ".join(new_rule))
-                    elif left == self.S:
-                        new_rules.add("ε")
-
-            new_P_dict[left] = list(new_rules)
-
-        self.P_dictionary = new_P_dict
-        print(self.display_P_dictionary(self.P_dictionary))
+                        new_rules[new_rule] = None
+                    elif left == self.start:
+                        new_rules[()] = None
+
+            new_productions[left] = list(new_rules)
+
+        self.productions = new_productions
+        self.report("\nStep 1: Eliminated ε-productions:")
+
+    def unit_target(self, rule):
+        if len(rule) == 1 and rule[0] in self.nonterminals:
+            return rule[0]
+        return None
+
+    def unit_components(self):
+        # Strongly connected components of the unit graph (A -> B for every
+        # rule A->B), found with an iterative Tarjan so deep chains cannot hit
+        # the recursion limit. Components come out successors first.
+        successors = {left: [target for target in map(self.unit_target, rights)
+                             if target is not None and target in self.productions]
+                      for left, rights in self.productions.items()}
+        index = {}
+        low = {}
+        stack = []
+        on_stack = set()
+        components = []
+
+        for root in self.productions:
+            if root in index:
+                continue
+            index[root] = low[root] = len(index)
+            stack.append(root)
+            on_stack.add(root)
+            work = [(root, iter(successors[root]))]
+            while work:
+                node, targets = work[-1]
+                for target in targets:
+                    if target not in index:
+                        index[target] = low[target] = len(index)
+                        stack.append(target)
+                        on_stack.add(target)
+                        work.append((target, iter(successors[target])))
+                        break
+                    if target in on_stack:
+                        low[node] = min(low[node], index[target])
+                else:
+                    work.pop()
+                    if work:
+                        parent = work[-1][0]
+                        low[parent] = min(low[parent], low[node])
+                    if low[node] == index[node]:
+                        component = []
+                        while True:
+                            member = stack.pop()
+                            on_stack.discard(member)
+                            component.append(member)
+                            if member == node:
+                                break
+                        components.append(component)
+
+        return components
 
     def eliminate_unit_rules(self):
-        print("\nStep 2: Eliminated unit rules:")
-        changed = True
-        while changed:
-            changed = False
-            for left in list(self.P_dictionary.keys()):
-                rules = list(self.P_dictionary[left])
-                new_rules = []
-
-                for rule in rules:
-                    if rule.strip() in self.Vn:
-                        if rule.strip() in self.P_dictionary:
-                            new_rules.extend(self.P_dictionary[rule.strip()])
-                            changed = True
-                    else:
-                        new_rules.append(rule)
-
-                self.P_dictionary[left] = new_rules
-
-        print(self.display_P_dictionary(self.P_dictionary))
+        # Every unit rule A->B is replaced by the rules of B, in place, with unit
+        # rules of B expanded the same way and repeated rules dropped. Components
+        # are closed successors first, so a unit rule leaving the component uses
+        # the finished list of its target. The members of a unit cycle all derive
+        # the same rules, so they share one list, built walking from the first.
+        # The ε-rule left on the start symbol stays its own: whatever reaches S
+        # by a unit rule was nullable already and its ε-variants exist.
+        closed = {}
+        for component in self.unit_components():
+            members = set(component)
+            rules = {}  # used as an ordered set
+            visited = {component[-1]}
+            work = [(component[-1], iter(self.productions[component[-1]]))]
+            while work:
+                owner, owner_rules = work[-1]
+                for rule in owner_rules:
+                    target = self.unit_target(rule)
+                    if target is None:
+                        if rule or owner == self.start:
+                            rules[rule] = None
+                    elif target in members:
+                        if target not in visited:
+                            visited.add(target)
+                            work.append((target, iter(self.productions[target])))
+                            break
+                    elif target == self.start:
+                        rules.update((rule, None) for rule in closed[target] if rule)
+                    elif target in closed:
+                        rules.update(dict.fromkeys(closed[target]))
+                else:
+                    work.pop()
+            rules = list(rules)
+            for symbol in component:
+                closed[symbol] = rules
+            if self.start in members and () in rules and len(component) > 1:
+                without_epsilon = [rule for rule in rules if rule]
+                for symbol in component:
+                    if symbol != self.start:
+                        closed[symbol] = without_epsilon
+
+        self.productions = {left: closed[left] for left in self.productions}
+        self.report("\nStep 2: Eliminated unit rules:")
 
     def eliminate_inaccessible_symbols(self):
-        print("\nStep 3: Eliminating inaccessible symbols:")
-        accessible = set()
-        queue = [self.S]
+        accessible = {self.start}
+        queue = deque([self.start])
 
         while queue:
-            current = queue.pop(0)
-            if current not in accessible:
-                accessible.add(current)
-                for rule in self.P_dictionary.get(current, []):
-                    for symbol in rule.split():
-                        if symbol in self.Vn and symbol not in accessible:
-                            queue.append(symbol)
+            current = queue.popleft()
+            for rule in self.productions.get(current, []):
+                for symbol in rule:
+                    if symbol in self.nonterminals and symbol not in accessible:
+                        accessible.add(symbol)
+                        queue.append(symbol)
 
-        to_remove = [nt for nt in self.Vn if nt not in accessible]
+        for nt in self.nonterminals - accessible:
+            self.productions.pop(nt, None)
 
-        for nt in to_remove:
-            if nt in self.P_dictionary:
-                del self.P_dictionary[nt]
-
-        self.Vn = [nt for nt in self.Vn if nt in accessible]
-        print(self.display_P_dictionary(self.P_dictionary))
+        self.nonterminals &= accessible
+        self.report("\nStep 3: Eliminating inaccessible symbols:")
 
     def eliminate_nonproductive_symbols(self):
-        print("\nStep 4: Eliminating non-productive symbols:")
-        productive = set()
-
-        # Find initially productive non-terminals (those that produce only terminals)
-        for left, rights in self.P_dictionary.items():
-            for rule in rights:
-                symbols = rule.split()
-                if all(symbol in self.Vt for symbol in symbols):
-                    productive.add(left)
-                    break
-
-        # Find all productive non-terminals
-        changed = True
-        while changed:
-            changed = False
-            for left, rights in self.P_dictionary.items():
-                if left in productive:
-                    continue
-
-                for rule in rights:
-                    symbols = rule.split()
-                    if all(symbol in self.Vt or symbol in productive for symbol in symbols):
-                        productive.add(left)
-                        changed = True
-                        break
+        productive = self.derivable(self.terminals)
 
         # Remove non-productive rules and symbols
-        new_P_dict = {}
-        for left, rights in self.P_dictionary.items():
+        new_productions = {}
+        for left, rights in self.productions.items():
             if left not in productive:
                 continue
 
-            new_rules = []
-            for rule in rights:
-                symbols = rule.split()
-                if all(symbol in self.Vt or symbol in productive for symbol in symbols):
-                    new_rules.append(rule)
+            new_rules = [rule for rule in rights
+                         if all(symbol in self.terminals or symbol in productive for symbol in rule)]
 
             if new_rules:
-                new_P_dict[left] = new_rules
+                new_productions[left] = new_rules
 
-        self.P_dictionary = new_P_dict
-        self.Vn = [nt for nt in self.Vn if nt in productive]
-        print(self.display_P_dictionary(self.P_dictionary))
+        self.productions = new_productions
+        self.nonterminals &= productive
+        self.report("\nStep 4: Eliminating non-productive symbols:")
 
     def convert_to_cnf(self):
-        print("\nStep 5: Converting to Chomsky Normal Form:")
-
-        # Step 1: Convert terminal symbols in longer productions
-        terminal_to_nonterminal = {}
-        new_nonterm_counter = 0
-
-        # Create new rules for terminals
-        for terminal in self.Vt:
-            new_nonterminal = f"T{new_nonterm_counter}"
-            new_nonterm_counter += 1
-            terminal_to_nonterminal[terminal] = new_nonterminal
-            self.P_dictionary[new_nonterminal] = [terminal]
-            self.Vn.append(new_nonterminal)
-
-        # Replace terminals in longer rules
-        for left in list(self.P_dictionary.keys()):
-            if left.startswith('T'):
-                continue
-
-            rules = list(self.P_dictionary[left])
+        # In one pass over the rules: terminals inside rules of two or more
+        # symbols get a proxy nonterminal (only those terminals, and an existing
+        # A->a is reused as the proxy of a), then rules longer than two symbols
+        # are split like in binarize_long_rules, sharing suffixes
+        proxies = {}
+        for left, rights in self.productions.items():
+            if len(rights) == 1 and len(rights[0]) == 1 and rights[0][0] in self.terminals \
+                    and left != self.start:
+                proxies.setdefault(rights[0][0], left)
+
+        suffixes = {}
+        for left in list(self.productions.keys()):
             new_rules = []
-
-            for rule in rules:
-                symbols = rule.split()
-
-                # Skip rules that already conform to CNF (single terminal or two non-terminals)
-                if len(symbols) == 1 and symbols[0] in self.Vt:
+            for rule in self.productions[left]:
+                if len(rule) < 2:
                     new_rules.append(rule)
                     continue
-
-                # Replace terminals with their corresponding non-terminals in multi-symbol rules
-                if len(symbols) >= 2:
-                    new_symbols = []
-                    for symbol in symbols:
-                        if symbol in self.Vt:
-                            new_symbols.append(terminal_to_nonterminal[symbol])
-                        else:
-                            new_symbols.append(symbol)
-                    new_rules.append(" ".join(new_symbols))
+                rule = tuple(self.proxy(symbol, proxies) for symbol in rule)
+                new_rules.append(self.split_rule(rule, suffixes, "N") if len(rule) > 2 else rule)
+            self.productions[left] = new_rules
+
+        self.report("\nStep 5: Converting to Chomsky Normal Form:")
+
+    def proxy(self, symbol, proxies):
+        if symbol not in self.terminals:
+            return symbol
+        nonterminal = proxies.get(symbol)
+        if nonterminal is None:
+            nonterminal = proxies[symbol] = self.fresh("T")
+            self.productions[nonterminal] = [(symbol,)]
+        return nonterminal
+
+    def chomsky_normal_form(self, order="classic"):
+        # Returns the converted grammar as a new object; this one is unchanged
+        if order not in self.ORDERS:
+            raise ValueError(f"Unknown conversion order '{order}', expected one of {self.ORDERS}")
+        grammar = self.copy()
+        steps = [("epsilons", grammar.eliminate_epsilons),
+                 ("unit", grammar.eliminate_unit_rules),
+                 ("inaccessible", grammar.eliminate_inaccessible_symbols),
+                 ("nonproductive", grammar.eliminate_nonproductive_symbols),
+                 ("cnf", grammar.convert_to_cnf)]
+        if order == "bin-first":
+            steps.insert(0, ("binarize", grammar.binarize_long_rules))
+
+        # Seconds per step, to tell which one a slow grammar is stuck in
+        grammar.timings = {}
+        for name, step in steps:
+            start = time.perf_counter()
+            step()
+            grammar.timings[name] = time.perf_counter() - start
+
+        grammar.rules = grammar.P_dictionary
+        grammar.in_cnf = True
+        grammar.cyk_tables = None
+        grammar.cyk_arrays = None
+        return grammar
+
+    def cyk_index(self):
+        # Built once per grammar: a bit per nonterminal, and reverse indexes
+        # from a terminal to the heads that produce it and from the first
+        # nonterminal of a binary rule to its (second nonterminal, heads) pairs
+        if self.cyk_tables is not None:
+            return self.cyk_tables
+        if not self.in_cnf:
+            raise ValueError("Grammar is not in Chomsky Normal Form, use the one chomsky_normal_form() returns")
+
+        bits = {symbol: bit for bit, symbol in enumerate(self.productions)}
+        terminal_heads = {}
+        pairs = [{} for _ in bits]
+        for left, rights in self.productions.items():
+            head = 1 << bits[left]
+            for rule in rights:
+                if len(rule) == 1 and rule[0] in self.terminals:
+                    terminal = self.symbols[rule[0]]
+                    terminal_heads[terminal] = terminal_heads.get(terminal, 0) | head
+                elif len(rule) == 2 and rule[0] in bits and rule[1] in bits:
+                    by_second = pairs[bits[rule[0]]]
+                    by_second[bits[rule[1]]] = by_second.get(bits[rule[1]], 0) | head
+                elif rule:
+                    raise ValueError(f"{self.symbols[left]}->{self.rule_text(rule)} "
+                                     f"is not in Chomsky Normal Form")
+
+        # Mask of every second nonterminal, to skip a first one at a glance
+        seconds = [sum(1 << bit for bit in by_second) for by_second in pairs]
+        self.cyk_tables = (bits, terminal_heads, pairs, seconds)
+        return self.cyk_tables
+
+    def cyk_chart(self, word):
+        # chart[length - 1][i] is the bitset of nonterminals deriving
+        # word[i:i + length]; a word is a string of one-character terminals or
+        # any sequence of terminal names
+        bits, terminal_heads, pairs, seconds = self.cyk_index()
+        n = len(word)
+        chart = [[terminal_heads.get(symbol, 0) for symbol in word]]
+        for length in range(2, n + 1):
+            row = []
+            for i in range(n - length + 1):
+                heads = 0
+                for split in range(1, length):
+                    left = chart[split - 1][i]
+                    right = chart[length - split - 1][i + split]
+                    if not right:
+                        continue
+                    while left:
+                        low = left & -left
+                        left ^= low
+                        first = low.bit_length() - 1
+                        common = right & seconds[first]
+                        if common:
+                            by_second = pairs[first]
+                            while common:
+                                low = common & -common
+                                common ^= low
+                                heads |= by_second[low.bit_length() - 1]
+                row.append(heads)
+            chart.append(row)
+        return chart
+
+    def accepts(self, word):
+        bits = self.cyk_index()[0]
+        if not word:
+            return () in self.productions.get(self.start, ())
+        if self.start not in bits:
+            return False
+        return bool(self.cyk_chart(word)[-1][0] >> bits[self.start] & 1)
+
+    def cyk_matrices(self, np):
+        # Dense form of cyk_index() for accepts_batch(): a row of heads per
+        # terminal (row 0 is for symbols outside Vt), and for every pair
+        # (first, second) of a binary rule a row of its heads
+        if self.cyk_arrays is not None:
+            return self.cyk_arrays
+        bits, terminal_heads, pairs, _ = self.cyk_index()
+
+        def row(mask):
+            return [mask >> bit & 1 for bit in range(len(bits))]
+
+        terminal_codes = {terminal: code for code, terminal in enumerate(terminal_heads, 1)}
+        terminal_rows = np.array([row(0)] + [row(mask) for mask in terminal_heads.values()],
+                                 dtype=bool).reshape(-1, len(bits))
+        firsts = []
+        seconds = []
+        pair_heads = []
+        for first, by_second in enumerate(pairs):
+            for second, heads in by_second.items():
+                firsts.append(first)
+                seconds.append(second)
+                pair_heads.append(row(heads))
+        self.cyk_arrays = (terminal_codes, terminal_rows, np.array(firsts, dtype=np.intp),
+                           np.array(seconds, dtype=np.intp),
+                           np.array(pair_heads, dtype=np.float32).reshape(-1, len(bits)))
+        return self.cyk_arrays
+
+    def cyk_same_length(self, np, words):
+        # CYK for words of one length at once. chart[length] has shape
+        # (spans, words, nonterminals); each length takes one combine step:
+        # the rule pairs present in every split are OR-ed together, then a
+        # single matrix product maps them to their heads.
+        bits = self.cyk_index()[0]
+        terminal_codes, terminal_rows, firsts, seconds, pair_heads = self.cyk_matrices(np)
+        n = len(words[0])
+        codes = np.array([[terminal_codes.get(symbol, 0) for symbol in word] for word in words],
+                         dtype=np.intp)
+        chart = [None, terminal_rows[codes.T]]
+        for length in range(2, n + 1):
+            spans = n - length + 1
+            hits = np.zeros((spans, len(words), len(firsts)), dtype=bool)
+            for split in range(1, length):
+                left = chart[split][:spans]
+                right = chart[length - split][split:split + spans]
+                hits |= left[..., firsts] & right[..., seconds]
+            heads = hits.reshape(spans * len(words), len(firsts)).astype(np.float32) @ pair_heads
+            chart.append(heads.reshape(spans, len(words), len(bits)) > 0)
+        return chart[n][0][:, bits[self.start]]
+
+    def accepts_batch(self, words, chunk_size=4096):
+        # accepts() for many words, with words of equal length run through
+        # CYK together in NumPy. Without NumPy it checks them one by one.
+        try:
+            import numpy as np
+        except ImportError:
+            return [self.accepts(word) for word in words]
+
+        bits = self.cyk_index()[0]
+        results = [False] * len(words)
+        by_length = {}
+        for index, word in enumerate(words):
+            by_length.setdefault(len(word), []).append(index)
+
+        for length, indexes in by_length.items():
+            if length == 0 or self.start not in bits:
+                for index in indexes:
+                    results[index] = self.accepts(words[index])
+                continue
+            for begin in range(0, len(indexes), chunk_size):
+                chunk = indexes[begin:begin + chunk_size]
+                accepted = self.cyk_same_length(np, [words[index] for index in chunk])
+                for index, ok in zip(chunk, accepted.tolist()):
+                    results[index] = ok
+        return results
+
+    def accepts_many(self, words, jobs=None, chunk_size=4096):
+        # accepts_batch() over a process pool; results come back in input
+        # order. Words are sorted by length first so every chunk sent to a
+        # worker holds few different lengths. jobs=1 stays in this process.
+        words = list(words)
+        if jobs == 1 or len(words) <= chunk_size:
+            return self.accepts_batch(words, chunk_size)
+
+        order = sorted(range(len(words)), key=lambda index: len(words[index]))
+        chunks = [[words[index] for index in order[begin:begin + chunk_size]]
+                  for begin in range(0, len(order), chunk_size)]
+        self.cyk_index()  # built once here and shipped with the grammar
+        results = [False] * len(words)
+        position = 0
+        with ProcessPoolExecutor(max_workers=jobs, initializer=set_worker_grammar,
+                                 initargs=(self,)) as executor:
+            for accepted in executor.map(accepts_in_worker, chunks):
+                for ok in accepted:
+                    results[order[position]] = ok
+                    position += 1
+        return results
+
+    def parse_chart(self, word):
+        # The CYK chart with nonterminal names: chart[length - 1][i] is the set
+        # of nonterminals deriving word[i:i + length]
+        names = [self.symbols[symbol] for symbol in self.cyk_index()[0]]
+        return [[{names[bit] for bit in range(mask.bit_length()) if mask >> bit & 1}
+                 for mask in row]
+                for row in self.cyk_chart(word)]
+
+    def earley_index(self):
+        # Tables for earley_accepts(), built once from the original rules. Items
+        # are (rule, dot, origin). A nullable symbol after the dot is stepped
+        # over as soon as the item is added (Aycock and Horspool), so spans[rule][dot]
+        # lists every dot reachable that way. predictions[A] is everything that
+        # predicting A adds at once: the items of A, of the nonterminals they
+        # predict in turn, and so on, with the nonterminals covered.
+        if self.earley_tables is not None:
+            return self.earley_tables
+        productions = self.original_productions
+        nullable = self.derivable(set(), productions)
+        heads = []
+        bodies = []
+        rules_of = {}
+        for left, rights in productions.items():
+            for rule in rights:
+                rules_of.setdefault(left, []).append(len(heads))
+                heads.append(left)
+                bodies.append(rule)
+
+        spans = []
+        for rule in bodies:
+            dots = [(len(rule),)]
+            for dot in range(len(rule) - 1, -1, -1):
+                dots.append((dot,) + dots[-1] if rule[dot] in nullable else (dot,))
+            spans.append(dots[::-1])
+
+        predictions = {}
+        for symbol in productions:
+            items = {}  # used as an ordered set
+            covered = {symbol}
+            queue = [symbol]
+            while queue:
+                for index in rules_of.get(queue.pop(), ()):
+                    for dot in spans[index][0]:
+                        items[(index, dot)] = None
+                        body = bodies[index]
+                        if dot < len(body) and body[dot] in productions and body[dot] not in covered:
+                            covered.add(body[dot])
+                            queue.append(body[dot])
+            predictions[symbol] = (tuple(items), frozenset(covered))
+
+        self.earley_tables = (heads, bodies, spans, predictions)
+        return self.earley_tables
+
+    def earley_accepts(self, word):
+        # Earley recognizer over the grammar as given, so it needs neither the
+        # conversion nor CNF. Right recursion uses Leo's shortcut: when a set
+        # holds a single item waiting for A, and A is its last symbol, finishing
+        # A only adds the topmost item of that chain of completions instead of
+        # every item along it, which keeps right-recursive grammars linear.
+        heads, bodies, spans, predictions = self.earley_index()
+        tokens = []
+        for symbol in word:
+            symbol_id = self.symbol_ids.get(symbol)
+            if symbol_id is None or symbol_id in self.original_nonterminals:
+                return False
+            tokens.append(symbol_id)
+
+        waiting_sets = []  # per set: symbol after the dot -> items
+        leo_sets = []  # per set: nonterminal -> topmost completed item, or None
+
+        def leo_item(position, symbol):
+            # The topmost item of the chain of completions that finishing
+            # symbol in set position starts. None: no shortcut, complete as
+            # usual. False: the chain runs into itself (a cycle of unit or
+            # nullable rules); its items are then all completed as usual, since
+            # no single one of them is topmost. Walked in a loop, as chains are
+            # as long as the word.
+            links = []  # (memo, symbol, its waiting item advanced) along the chain
+            while True:
+                memo = leo_sets[position]
+                if symbol in memo:
+                    item = memo[symbol]
+                    break
+                memo[symbol] = False
+                waiting = waiting_sets[position].get(symbol, ())
+                if len(waiting) != 1 or waiting[0][1] != len(bodies[waiting[0][0]]) - 1:
+                    item = memo[symbol] = None
+                    break
+                index, dot, origin = waiting[0]
+                links.append((memo, symbol, (index, dot + 1, origin)))
+                position, symbol = origin, heads[index]
+            for memo, symbol, advanced in reversed(links):
+                if item is False:
+                    memo[symbol] = None
                 else:
-                    new_rules.append(rule)
-
-            self.P_dictionary[left] = new_rules
-
-        # Step 2: Break rules with more than 2 symbols on the right side
-        pair_to_nonterminal = {}
-
-        changed = True
-        while changed:
-            changed = False
-            for left in list(self.P_dictionary.keys()):
-                if left.startswith('T'):
-                    continue
-
-                rules = list(self.P_dictionary[left])
-                new_rules = []
-
-                for rule in rules:
-                    symbols = rule.split()
-
-                    if len(symbols) <= 2:
-                        new_rules.append(rule)
+                    item = memo[symbol] = item or advanced
+            return item
+
+        items = [(index, dot, 0) for index, dot in predictions.get(self.start, ((), ()))[0]]
+        for position in range(len(tokens) + 1):
+            seen = set()
+            waiting = {}
+            covered = set()
+            waiting_sets.append(waiting)
+            # The start symbol's items from set 0 decide acceptance, so a
+            # chain may never skip over them
+            leo_sets.append({self.start: None} if position == 0 else {})
+            work = []
+
+            def add(index, dot, origin):
+                for dot in spans[index][dot]:
+                    item = (index, dot, origin)
+                    if item in seen:
+                        continue
+                    seen.add(item)
+                    work.append(item)
+
+            for item in items:
+                if item not in seen:
+                    seen.add(item)
+                    work.append(item)
+            while work:
+                index, dot, origin = work.pop()
+                body = bodies[index]
+                if dot < len(body):
+                    symbol = body[dot]
+                    waiting.setdefault(symbol, []).append((index, dot, origin))
+                    if symbol in predictions and symbol not in covered:
+                        predicted, symbols = predictions[symbol]
+                        covered.update(symbols)
+                        for rule, rule_dot in predicted:
+                            add(rule, rule_dot, position)
+                elif origin < position:
+                    # Completions of empty spans are already covered by
+                    # stepping over nullable symbols
+                    head = heads[index]
+                    topmost = leo_item(origin, head)
+                    if topmost:
+                        add(*topmost)
                     else:
-                        # Create a new non-terminal for the first two symbols
-                        first_pair = " ".join(symbols[:2])
-
-                        if first_pair not in pair_to_nonterminal:
-                            new_nonterminal = f"N{new_nonterm_counter}"
-                            new_nonterm_counter += 1
-                            pair_to_nonterminal[first_pair] = new_nonterminal
-                            self.P_dictionary[new_nonterminal] = [first_pair]
-                            self.Vn.append(new_nonterminal)
-
-                        new_rule = pair_to_nonterminal[first_pair]
-                        if len(symbols) > 2:
-                            new_rule += " " + " ".join(symbols[2:])
-
-                        new_rules.append(new_rule)
-                        changed = True
-
-                self.P_dictionary[left] = new_rules
-
-        print(self.display_P_dictionary(self.P_dictionary))
-
-    def chomsky_normal_form(self):
-        self.eliminate_epsilons()
-        self.eliminate_unit_rules()
-        self.eliminate_inaccessible_symbols()
-        self.eliminate_nonproductive_symbols()
-        self.convert_to_cnf()
-        self.rules = self.P_dictionary
+                        for rule, rule_dot, rule_origin in waiting_sets[origin].get(head, ()):
+                            add(rule, rule_dot + 1, rule_origin)
+
+            if position == len(tokens):
+                return any(heads[index] == self.start and dot == len(bodies[index]) and origin == 0
+                           for index, dot, origin in seen)
+            items = [(index, next_dot, origin)
+                     for index, dot, origin in waiting.get(tokens[position], ())
+                     for next_dot in spans[index][dot + 1]]
+            if not items:
+                return False
 
     def display_P_dictionary(self, P_dictionary):
         result = []
@@ -262,11 +762,203 @@ class Chomsky:
         return ', '.join(result)
 
 
+worker_grammar = None
+
+
+def set_worker_grammar(grammar):
+    global worker_grammar
+    worker_grammar = grammar
+
+
+def accepts_in_worker(words):
+    return worker_grammar.accepts_batch(words)
+
+
+def normalize_one(item, order="classic"):
+    # One grammar of a batch: a "S->bA|AC, ..." string, or a dict with P (a
+    # string or a dict of rules) and optionally S, Vn and Vt. Failures come
+    # back as a record with "error" set, so one bad grammar does not stop a run.
+    try:
+        if isinstance(item, str):
+            grammar = Chomsky.from_productions(item)
+        elif "Vn" in item:
+            grammar = Chomsky(item["Vn"], item.get("Vt"), item["P"], item.get("S", "S"))
+        else:
+            grammar = Chomsky.from_productions(item["P"], item.get("S", "S"))
+        start = time.perf_counter()
+        cnf = grammar.chomsky_normal_form(order)
+        total = time.perf_counter() - start
+    except Exception as error:
+        return {"error": f"{type(error).__name__}: {error}"}
+    return {"S": cnf.S, "P": str(cnf),
+            "rules": sum(len(rights) for rights in cnf.productions.values()),
+            "timings": cnf.timings, "total": total}
+
+
+def normalize_chunk(items, order):
+    return [normalize_one(item, order) for item in items]
+
+
+def normalize_many(items, jobs=None, order="classic", chunk_size=32):
+    # Converts grammars over a process pool and yields their records in input
+    # order, as soon as all earlier ones are done. Grammars go to the workers
+    # in chunks, and only a few chunks per worker are in flight, so a long
+    # input is read as it is consumed. jobs=1 stays in this process.
+    if jobs == 1:
+        for item in items:
+            yield normalize_one(item, order)
+        return
+
+    items = iter(items)
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        in_flight = deque()
+        limit = 4 * (jobs or os.cpu_count() or 1)
+        while True:
+            while len(in_flight) < limit:
+                chunk = list(itertools.islice(items, chunk_size))
+                if not chunk:
+                    break
+                in_flight.append(executor.submit(normalize_chunk, chunk, order))
+            if not in_flight:
+                return
+            yield from in_flight.popleft().result()
+
+
+def read_grammars(paths):
+    # One grammar per line: a P string, or a JSON object (JSONL)
+    for path in paths:
+        with (sys.stdin if path == "-" else open(path, encoding="utf-8")) as source:
+            for line in source:
+                line = line.strip()
+                if not line:
+                    continue
+                yield json.loads(line) if line.startswith("{") else line
+
+
+def run_normalize(paths, jobs, order, out_path=None, slowest=5):
+    out = open(out_path, "w", encoding="utf-8") if out_path else sys.stdout
+    start_time = time.perf_counter()
+    count = errors = 0
+    totals = {}
+    slow = []
+    try:
+        for index, record in enumerate(normalize_many(read_grammars(paths), jobs, order)):
+            count += 1
+            record = {"index": index, **record}
+            out.write(json.dumps(record, ensure_ascii=False) + "\n")
+            if "error" in record:
+                errors += 1
+                print(f"error {index}: {record['error']}", file=sys.stderr)
+                continue
+            for step, seconds in record["timings"].items():
+                totals[step] = totals.get(step, 0.0) + seconds
+            slow.append((record["total"], index, record["timings"]))
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+    elapsed = time.perf_counter() - start_time
+    rate = count / elapsed if elapsed else 0.0
+    print(f"\n{count} grammars ({errors} failed) in {elapsed:.3f} s: {rate:.1f} grammars/s",
+          file=sys.stderr)
+    print("Time per step: " + ", ".join(f"{step} {seconds:.3f} s" for step, seconds in totals.items()),
+          file=sys.stderr)
+    for total, index, timings in sorted(slow, reverse=True)[:slowest]:
+        steps = ", ".join(f"{step} {seconds:.4f}" for step, seconds in timings.items())
+        print(f"slowest {index}: {total:.4f} s ({steps})", file=sys.stderr)
+    return 1 if errors else 0
+
+
+def benchmark(Vn, Vt, P, S, count=200, length=30, seed=0):
+    # Earley on the grammar as given against the conversion plus CYK, on random
+    # words over Vt
+    rng = random.Random(seed)
+    words = ["".join(rng.choice(Vt) for _ in range(length)) for _ in range(count)]
+    grammar = Chomsky(Vn, Vt, P, S)
+    start = time.perf_counter()
+    grammar = grammar.chomsky_normal_form()
+    convert_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    earley = [grammar.earley_accepts(word) for word in words]
+    earley_time = time.perf_counter() - start
+    start = time.perf_counter()
+    cyk = [grammar.accepts(word) for word in words]
+    cyk_time = time.perf_counter() - start
+    if earley != cyk:
+        raise RuntimeError("Earley and CYK disagree")
+
+    rules = sum(len(rights) for rights in grammar.productions.values())
+    print(f"{count} words of length {length}, {sum(cyk)} accepted")
+    print(f"Earley on the original grammar: {earley_time:.3f}s")
+    print(f"CYK on the CNF grammar ({rules} rules): {cyk_time:.3f}s "
+          f"+ {convert_time:.3f}s conversion")
+
+
+def random_grammar(rng, nonterminals="SABC", terminals="ab", rules=3, length=3):
+    # A small "S->...|..., A->..." string; ε-rules and unit rules are common,
+    # so nullable and unit cycles come up often
+    alternatives = []
+    for left in nonterminals:
+        rights = set()
+        for _ in range(rng.randint(1, rules)):
+            size = rng.choice([0, 1, 1] + list(range(2, length + 1)))
+            rights.add("".join(rng.choice(nonterminals + terminals) for _ in range(size)) or "ε")
+        alternatives.append(f"{left}->{'|'.join(sorted(rights))}")
+    return ", ".join(alternatives)
+
+
+def crosscheck(count=300, max_length=6, seed=0):
+    # Earley against CNF conversion plus CYK on random grammars, for every word
+    # up to max_length; raises on the first word they disagree on
+    rng = random.Random(seed)
+    words = ["".join(word) for length in range(max_length + 1)
+             for word in itertools.product("ab", repeat=length)]
+    start = time.perf_counter()
+    for _ in range(count):
+        P = random_grammar(rng)
+        grammar = Chomsky.from_productions(P)
+        cnf = grammar.chomsky_normal_form()
+        for word in words:
+            if grammar.earley_accepts(word) != cnf.accepts(word):
+                raise RuntimeError(f"Earley and CYK disagree on {word!r} for {P}")
+    print(f"{count} random grammars, {len(words)} words each: Earley and CYK agree "
+          f"({time.perf_counter() - start:.3f}s)")
+
+
+def cli(argv, Vn, Vt, P, S):
+    arg_parser = argparse.ArgumentParser(prog="chom.py", description="Chomsky Normal Form conversion")
+    commands = arg_parser.add_subparsers(dest="command", required=True)
+    normalize_command = commands.add_parser("normalize", help="convert many grammars in parallel")
+    normalize_command.add_argument("files", nargs="+",
+                                   help="files with one grammar per line (P string or JSON), - for stdin")
+    normalize_command.add_argument("--jobs", "-j", type=int, default=None,
+                                   help="worker processes (default: CPU count)")
+    normalize_command.add_argument("--order", choices=Chomsky.ORDERS, default="classic")
+    normalize_command.add_argument("--out", default=None,
+                                   help="file to write the JSONL results to (default: stdout)")
+    commands.add_parser("benchmark", help="compare Earley and CYK on the built-in grammar")
+    crosscheck_command = commands.add_parser("crosscheck",
+                                             help="check Earley against CYK on random grammars")
+    crosscheck_command.add_argument("--count", type=int, default=300)
+    crosscheck_command.add_argument("--seed", type=int, default=0)
+    args = arg_parser.parse_args(argv)
+    if args.command == "normalize":
+        return run_normalize(args.files, args.jobs, args.order, args.out)
+    if args.command == "crosscheck":
+        crosscheck(args.count, seed=args.seed)
+        return 0
+    benchmark(Vn, Vt, P, S)
+    return 0
+
+
 if __name__ == "__main__":
     Vn = ["S", "A", "B", "C", "D"]
     Vt = ["a", "b"]
     P = "S->bA|AC, A->bS|BC|AbAa, B->BbaA|a|bSa, C->ε, D->AB"
     S = "S"
 
-    chomsky = Chomsky(Vn, Vt, P, S)
-    chomsky.chomsky_normal_form()
\ No newline at end of file
+    if sys.argv[1:]:
+        sys.exit(cli(sys.argv[1:], Vn, Vt, P, S))
+    chomsky = Chomsky(Vn, Vt, P, S, verbose=True)
+    chomsky.chomsky_normal_form()
@@ -1,5 +1,7 @@
 from enum import Enum, auto
-from typing import List, Optional
+from fractions import Fraction
+from typing import Iterator, List, Optional, Sequence, TextIO
+from Tables import exact_duration, midi_number
 
 class NodeType(Enum):
     # Music structure nodes
@@ -27,177 +29,151 @@ class NodeType(Enum):
     NUMBER = auto()        # Numeric value
     IDENTIFIER = auto()    # Variable name
 
+# Shared by every node that has no children yet (most of them are notes),
+# so leaves do not each carry an empty list
+NO_CHILDREN: Sequence['ASTNode'] = ()
+
 class ASTNode:
+    # Scores hold millions of nodes: no per-instance __dict__
+    __slots__ = ("type", "value", "children", "_parent")
+    
     def __init__(self, node_type: NodeType, value: Optional[str] = None):
         self.type = node_type
         self.value = value
-        self.children: List[ASTNode] = []
+        self.children: Sequence[ASTNode] = NO_CHILDREN
         self._parent = None
     
     def add_child(self, child: 'ASTNode') -> None:
+        if self.children is NO_CHILDREN:
+            self.children = []
         self.children.append(child)
         child._parent = self
     
     def is_last_child(self) -> bool:
         if not self._parent:
             return True
-        return self._parent.children[-1] == self
+        return self._parent.children[-1] is self
     
-    def __str__(self, level: int = 0) -> str:
-        # For root node, don't add any prefix
+    def label(self) -> str:
+        # Text shown for this node in the tree, without prefix or newline
+        if self.value is not None:
+            return f"{self.type.name}: {self.value}"
+        return self.type.name
+    
+    def lines(self, level: int = 0) -> Iterator[str]:
+        """Yield the tree drawing of this subtree one line at a time.
+        
+        Walks the tree with an explicit stack instead of recursion, so deep
+        trees cannot hit the recursion limit and nothing is concatenated.
+        """
         if level == 0:
-            ret = f"{self.type.name}"
-            if self.value is not None:
-                ret += f": {self.value}"
-            ret += "\n"
+            yield self.label() + "\n"
         else:
-            # For all other nodes, add proper tree structure
-            prefix = "│   " * (level - 1)
-            if level > 0:
-                prefix += "└── " if self.is_last_child() else "├── "
-            ret = prefix + f"{self.type.name}"
-            if self.value is not None:
-                ret += f": {self.value}"
-            ret += "\n"
+            yield ("│   " * (level - 1) + ("└── " if self.is_last_child() else "├── ")
+                   + self.label() + "\n")
         
-        # Add children with proper indentation
-        for child in self.children:
-            ret += child.__str__(level + 1)
-        return ret
+        # Prefixes depend only on the depth and on whether a node is the last child
+        prefixes = {}
+        stack = [(self.children, 0, level + 1)]
+        while stack:
+            children, index, depth = stack[-1]
+            if index == len(children):
+                stack.pop()
+                continue
+            stack[-1] = (children, index + 1, depth)
+            
+            last = index == len(children) - 1
+            prefix = prefixes.get((depth, last))
+            if prefix is None:
+                prefix = "│   " * (depth - 1) + ("└── " if last else "├── ")
+                prefixes[(depth, last)] = prefix
+            
+            child = children[index]
+            yield prefix + child.label() + "\n"
+            if child.children:
+                stack.append((child.children, 0, depth + 1))
+    
+    def write(self, out: TextIO, level: int = 0) -> None:
+        out.writelines(self.lines(level))
+    
+    def __str__(self, level: int = 0) -> str:
+        return "".join(self.lines(level))
 
 class NoteNode(ASTNode):
-    def __init__(self, pitch: str, octave: int, duration: float, modifiers: List[str] = None):
+    __slots__ = ("pitch", "octave", "duration", "modifiers", "midi", "exact_duration")
+    
+    def __init__(self, pitch: str, octave: int, duration: float, modifiers: List[str] = None,
+                 exact: Optional[Fraction] = None):
         super().__init__(NodeType.NOTE)
         self.pitch = pitch
         self.octave = octave
         self.duration = duration
-        self.modifiers = modifiers or []
+        # Unmodified notes share the empty tuple
+        self.modifiers = tuple(modifiers) if modifiers else ()
+        # Both come from the shared tables in Tables.py: the MIDI number, and the
+        # length in whole notes as a Fraction (`duration` is its float, for display)
+        self.midi = midi_number(pitch, octave, self.modifiers)
+        self.exact_duration = exact if exact is not None else exact_duration(duration)
     
-    def __str__(self, level: int = 0) -> str:
-        if level == 0:
-            ret = f"{self.type.name}"
-            ret += f": {self.pitch}{self.octave} ({self.duration})"
-            if self.modifiers:
-                ret += f" {''.join(self.modifiers)}"
-            ret += "\n"
-        else:
-            prefix = "│   " * (level - 1)
-            if level > 0:
-                prefix += "└── " if self.is_last_child() else "├── "
-            ret = prefix + f"{self.type.name}"
-            ret += f": {self.pitch}{self.octave} ({self.duration})"
-            if self.modifiers:
-                ret += f" {''.join(self.modifiers)}"
-            ret += "\n"
-        
-        for child in self.children:
-            ret += child.__str__(level + 1)
-        return ret
+    def label(self) -> str:
+        if self.modifiers:
+            return f"{self.type.name}: {self.pitch}{self.octave} ({self.duration}) {''.join(self.modifiers)}"
+        return f"{self.type.name}: {self.pitch}{self.octave} ({self.duration})"
 
 class RestNode(ASTNode):
-    def __init__(self, duration: float):
+    __slots__ = ("duration", "exact_duration")
+    
+    def __init__(self, duration: float, exact: Optional[Fraction] = None):
         super().__init__(NodeType.REST)
         self.duration = duration
+        self.exact_duration = exact if exact is not None else exact_duration(duration)
     
-    def __str__(self, level: int = 0) -> str:
-        if level == 0:
-            ret = f"{self.type.name}"
-            ret += f": {self.duration}"
-            ret += "\n"
-        else:
-            prefix = "│   " * (level - 1)
-            if level > 0:
-                prefix += "└── " if self.is_last_child() else "├── "
-            ret = prefix + f"{self.type.name}"
-            ret += f": {self.duration}"
-            ret += "\n"
-        
-        for child in self.children:
-            ret += child.__str__(level + 1)
-        return ret
+    def label(self) -> str:
+        return f"{self.type.name}: {self.duration}"
 
 class BarNode(ASTNode):
+    __slots__ = ()
+    
     def __init__(self):
         super().__init__(NodeType.BAR)
     
-    def __str__(self, level: int = 0) -> str:
-        if level == 0:
-            ret = f"{self.type.name}\n"
-        else:
-            prefix = "│   " * (level - 1)
-            if level > 0:
-                prefix += "└── " if self.is_last_child() else "├── "
-            ret = prefix + f"{self.type.name}\n"
-        
-        for child in self.children:
-            ret += child.__str__(level + 1)
-        return ret
+    def label(self) -> str:
+        return self.type.name
 
 class RepeatNode(ASTNode):
+    __slots__ = ()
+    
     def __init__(self):
         super().__init__(NodeType.REPEAT, "2x")
-    
-    def __str__(self, level: int = 0) -> str:
-        if level == 0:
-            ret = f"{self.type.name}"
-            if self.value is not None:
-                ret += f": {self.value}"
-            ret += "\n"
-        else:
-            prefix = "│   " * (level - 1)
-            if level > 0:
-                prefix += "└── " if self.is_last_child() else "├── "
-            ret = prefix + f"{self.type.name}"
-            if self.value is not None:
-                ret += f": {self.value}"
-            ret += "\n"
-        
-        for child in self.children:
-            ret += child.__str__(level + 1)
-        return ret
 
 class DynamicNode(ASTNode):
+    __slots__ = ()
+    
     def __init__(self, dynamic: str):
         super().__init__(NodeType.DYNAMIC, dynamic)
-    
-    def __str__(self, level: int = 0) -> str:
-        if level == 0:
-            ret = f"{self.type.name}"
-            if self.value is not None:
-                ret += f": {self.value}"
-            ret += "\n"
-        else:
-            prefix = "│   " * (level - 1)
-            if level > 0:
-                prefix += "└── " if self.is_last_child() else "├── "
-            ret = prefix + f"{self.type.name}"
-            if self.value is not None:
-                ret += f": {self.value}"
-            ret += "\n"
-        
-        for child in self.children:
-            ret += child.__str__(level + 1)
-        return ret
 
 class TempoNode(ASTNode):
+    __slots__ = ()
+    
     def __init__(self, bpm: int):
         super().__init__(NodeType.TEMPO, f"{bpm} BPM")
+
+class TransposeNode(ASTNode):
+    """\\transpose: the notes that follow sound `semitones` higher (lower if negative).
     
-    def __str__(self, level: int = 0) -> str:
-        if level == 0:
-            ret = f"{self.type.name}"
-            if self.value is not None:
-                ret += f": {self.value}"
-            ret += "\n"
-        else:
-            prefix = "│   " * (level - 1)
-            if level > 0:
-                prefix += "└── " if self.is_last_child() else "├── "
-            ret = prefix + f"{self.type.name}"
-            if self.value is not None:
-                ret += f": {self.value}"
-            ret += "\n"
-        
-        for child in self.children:
-            ret += child.__str__(level + 1)
-        return ret 
\ No newline at end of file
+    Stored as the operator with the amount as its NUMBER child; the other
+    operand is the pitch of every note it applies to.
+    """
+    __slots__ = ()
+    
+    def __init__(self, semitones: Optional[int] = None):
+        super().__init__(NodeType.BINARY_OP, "-" if semitones is not None and semitones < 0 else "+")
+        if semitones is not None:
+            self.add_child(ASTNode(NodeType.NUMBER, str(abs(semitones))))
+    
+    @property
+    def semitones(self) -> int:
+        if not self.children:
+            return 0
+        amount = int(self.children[0].value)
+        return -amount if self.value == "-" else amount
@@ -0,0 +1,101 @@
+import wave
+from typing import Iterable, Optional
+import numpy as np
+from AST import ASTNode
+from Events import Event, iter_events
+
+SAMPLE_RATE = 44100
+# Frames synthesized and written per step; memory use depends on this, not
+# on the length of the score
+CHUNK_FRAMES = 1 << 16
+
+ATTACK = 0.005   # seconds to reach full volume
+RELEASE = 0.03   # seconds to fade out at the end of each note
+GAIN = 0.3       # peak amplitude of a note at velocity 127
+
+def frequencies(pitches: np.ndarray) -> np.ndarray:
+    return 440.0 * 2.0 ** ((pitches - 69) / 12.0)
+
+def synthesize(buffer: np.ndarray, first_frame: int, starts: np.ndarray, ends: np.ndarray,
+               pitches: np.ndarray, velocities: np.ndarray, sample_rate: int) -> None:
+    """Mix every note into buffer, which holds the frames from first_frame on.
+
+    All samples of all notes are computed together: each note's frames are
+    laid out one after the other, tagged with the note they belong to, and
+    the oscillator and envelope run over that flat array in one go.
+    """
+    size = len(buffer)
+    # The part of each note that falls inside the buffer
+    lows = np.maximum(starts, first_frame)
+    highs = np.minimum(ends, first_frame + size)
+    counts = np.maximum(highs - lows, 0)
+    total = int(counts.sum())
+    if not total:
+        return
+
+    notes = np.repeat(np.arange(len(counts)), counts)
+    # Index of every sample within its own run, then within its note
+    run_starts = np.cumsum(counts) - counts
+    offsets = np.arange(total) - run_starts[notes] + (lows - starts)[notes]
+    times = offsets / sample_rate
+    lengths = (ends - starts)[notes] / sample_rate
+
+    envelope = np.minimum(np.minimum(times / ATTACK, (lengths - times) / RELEASE), 1.0)
+    amplitude = (GAIN / 127.0) * velocities[notes] * np.clip(envelope, 0.0, 1.0)
+    samples = amplitude * np.sin(2.0 * np.pi * frequencies(pitches)[notes] * times)
+
+    frames = offsets + starts[notes] - first_frame
+    buffer += np.bincount(frames, weights=samples, minlength=size)[:size]
+
+def render_events(events: Iterable[Event], path: str, sample_rate: int = SAMPLE_RATE,
+                  chunk_frames: int = CHUNK_FRAMES) -> int:
+    """Write events to a 16-bit mono WAV file; returns the number of frames.
+
+    Events are read as the output advances, so an iterator over a long score
+    is never held in memory: only the notes sounding in the current chunk are.
+    """
+    events = iter(events)
+    buffer = np.zeros(chunk_frames, dtype=np.float64)
+    sounding = []  # (start frame, end frame, pitch, velocity) of notes not finished yet
+    upcoming: Optional[tuple] = None
+    frames_written = 0
+
+    def next_note() -> Optional[tuple]:
+        for event in events:
+            start = round(event.onset_seconds * sample_rate)
+            end = round((event.onset_seconds + event.duration_seconds) * sample_rate)
+            if end > start:
+                return (start, end, event.pitch, event.velocity)
+        return None
+
+    with wave.open(path, "wb") as out:
+        out.setnchannels(1)
+        out.setsampwidth(2)
+        out.setframerate(sample_rate)
+
+        upcoming = next_note()
+        last_frame = 0
+        while sounding or upcoming is not None:
+            chunk_end = frames_written + chunk_frames
+            while upcoming is not None and upcoming[0] < chunk_end:
+                sounding.append(upcoming)
+                last_frame = max(last_frame, upcoming[1])
+                upcoming = next_note()
+
+            buffer.fill(0.0)
+            if sounding:
+                starts, ends, pitches, velocities = (np.array(column) for column in zip(*sounding))
+                synthesize(buffer, frames_written, starts, ends, pitches, velocities, sample_rate)
+
+            # The last chunk stops where the last note does
+            size = chunk_frames if upcoming is not None else min(chunk_frames, last_frame - frames_written)
+            pcm = np.clip(buffer[:size], -1.0, 1.0) * 32767.0
+            out.writeframes(pcm.astype("<i2").tobytes())
+            frames_written += size
+            sounding = [note for note in sounding if note[1] > frames_written]
+
+    return frames_written
+
+def render(root: ASTNode, path: str, sample_rate: int = SAMPLE_RATE,
+           chunk_frames: int = CHUNK_FRAMES) -> int:
+    return render_events(iter_events(root), path, sample_rate, chunk_frames)
@@ -0,0 +1,267 @@
+import mmap
+import struct
+import sys
+from array import array
+from typing import Iterator, List, Optional, Tuple, Union
+from AST import *
+
+# Layout of a score file (all integers little-endian, every section starts
+# on an 8-byte boundary):
+#
+#   header     MAGIC, version, node count, note count, string count, string bytes
+#   types      uint8   per node    NodeType value
+#   sizes      uint32  per node    nodes in the subtree rooted here, itself included
+#   values     int32   per node    string table index of node.value, -1 for None
+#   payloads   int32   per node    row in the note arrays for notes and rests, else -1
+#   pitches    uint8   per row     ord(pitch), 0 for rests
+#   octaves    int32   per row
+#   durations  float64 per row
+#   modifiers  int32   per row     string table index of ''.join(modifiers), -1 if none
+#   offsets    uint32  per string + 1, into the string bytes
+#   strings    UTF-8 bytes
+#
+# Nodes are stored in preorder, so the children of node i start at i + 1 and
+# each next sibling is found by skipping the previous sibling's subtree size.
+MAGIC = b"LFA6AST\0"
+FORMAT_VERSION = 1
+HEADER = struct.Struct("<8sHHIIII")
+
+NODE_TYPES = {node_type.value: node_type for node_type in NodeType}
+
+def align(offset: int) -> int:
+    return (offset + 7) & ~7
+
+def little_endian(values: array) -> bytes:
+    if sys.byteorder == "big":
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+def dumps(root: ASTNode) -> bytes:
+    types = array('B')
+    values = array('i')
+    payloads = array('i')
+    pitches = array('B')
+    octaves = array('i')
+    durations = array('d')
+    modifiers = array('i')
+    strings: List[str] = []
+    string_ids = {}
+    parents = array('i')
+
+    def intern(text: Optional[str]) -> int:
+        if text is None:
+            return -1
+        index = string_ids.get(text)
+        if index is None:
+            index = string_ids[text] = len(strings)
+            strings.append(text)
+        return index
+
+    # Preorder walk; children are pushed reversed so they pop in order
+    stack = [(root, -1)]
+    while stack:
+        node, parent = stack.pop()
+        types.append(node.type.value)
+        values.append(intern(node.value))
+        parents.append(parent)
+        if isinstance(node, NoteNode):
+            payloads.append(len(pitches))
+            try:
+                pitches.append(ord(node.pitch))
+                octaves.append(node.octave)
+            except OverflowError:
+                raise ValueError(f"Note {node.pitch}{node.octave} is outside the range a score "
+                                 f"file can store (octaves must fit in 32 bits)") from None
+            durations.append(node.duration)
+            modifiers.append(intern(''.join(node.modifiers)) if node.modifiers else -1)
+        elif isinstance(node, RestNode):
+            payloads.append(len(pitches))
+            pitches.append(0)
+            octaves.append(0)
+            durations.append(node.duration)
+            modifiers.append(-1)
+        else:
+            payloads.append(-1)
+        index = len(types) - 1
+        for child in reversed(node.children):
+            stack.append((child, index))
+
+    # Children come after their parent, so one backwards pass totals every subtree
+    sizes = array('I', [1]) * len(types)
+    for index in range(len(types) - 1, 0, -1):
+        sizes[parents[index]] += sizes[index]
+
+    encoded = [text.encode() for text in strings]
+    offsets = array('I', [0])
+    for data in encoded:
+        offsets.append(offsets[-1] + len(data))
+    blob = b"".join(encoded)
+
+    out = bytearray(HEADER.pack(MAGIC, FORMAT_VERSION, 0, len(types), len(pitches),
+                                len(strings), len(blob)))
+    for section in (types, sizes, values, payloads, pitches, octaves, durations,
+                    modifiers, offsets):
+        out.extend(bytes(align(len(out)) - len(out)))
+        out.extend(little_endian(section))
+    out.extend(bytes(align(len(out)) - len(out)))
+    out.extend(blob)
+    return bytes(out)
+
+def write(root: ASTNode, path: str) -> None:
+    with open(path, 'wb') as f:
+        f.write(dumps(root))
+
+class ScoreFile:
+    """Read-only view of a serialized score.
+
+    The arrays are memoryviews over the underlying buffer (a memory-mapped
+    file when opened with open()), so walking a score copies nothing and
+    loading cost does not depend on its size. `pitches`, `octaves` and
+    `durations` can be handed to array libraries as they are.
+    """
+    def __init__(self, buffer: Union[bytes, bytearray, mmap.mmap]):
+        self._mmap = buffer if isinstance(buffer, mmap.mmap) else None
+        view = memoryview(buffer)
+        magic, version, _, nodes, notes, string_count, string_size = HEADER.unpack_from(view)
+        if magic != MAGIC:
+            raise ValueError("Not a serialized score")
+        if version != FORMAT_VERSION:
+            raise ValueError(f"Unsupported score format version {version}")
+
+        offset = HEADER.size
+        def section(typecode: str, count: int):
+            nonlocal offset
+            offset = align(offset)
+            size = array(typecode).itemsize * count
+            data = view[offset:offset + size]
+            offset += size
+            if sys.byteorder == "big":
+                swapped = array(typecode, data.tobytes())
+                swapped.byteswap()
+                return memoryview(swapped)
+            return data.cast(typecode)
+
+        self.types = section('B', nodes)
+        self.sizes = section('I', nodes)
+        self.values = section('i', nodes)
+        self.payloads = section('i', nodes)
+        self.pitches = section('B', notes)
+        self.octaves = section('i', notes)
+        self.durations = section('d', notes)
+        self.modifiers = section('i', notes)
+        self.offsets = section('I', string_count + 1)
+        offset = align(offset)
+        self.strings = view[offset:offset + string_size]
+        self._string_cache = {}
+
+    @classmethod
+    def open(cls, path: str) -> 'ScoreFile':
+        with open(path, 'rb') as f:
+            return cls(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+    def close(self) -> None:
+        # Drop the views first, an mmap with exported buffers cannot be closed
+        for name in ("types", "sizes", "values", "payloads", "pitches", "octaves",
+                     "durations", "modifiers", "offsets", "strings"):
+            getattr(self, name).release()
+        if self._mmap is not None:
+            self._mmap.close()
+
+    def __enter__(self) -> 'ScoreFile':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def __len__(self) -> int:
+        return len(self.types)
+
+    def string(self, index: int) -> Optional[str]:
+        if index < 0:
+            return None
+        text = self._string_cache.get(index)
+        if text is None:
+            text = bytes(self.strings[self.offsets[index]:self.offsets[index + 1]]).decode()
+            self._string_cache[index] = text
+        return text
+
+    def type(self, index: int) -> NodeType:
+        return NODE_TYPES[self.types[index]]
+
+    def value(self, index: int) -> Optional[str]:
+        return self.string(self.values[index])
+
+    def children(self, index: int) -> Iterator[int]:
+        child = index + 1
+        end = index + self.sizes[index]
+        while child < end:
+            yield child
+            child += self.sizes[child]
+
+    def note(self, index: int) -> Tuple[str, int, float, str]:
+        """(pitch, octave, duration, modifiers) of a note; pitch is '' for rests."""
+        row = self.payloads[index]
+        if row < 0:
+            raise ValueError(f"Node {index} is a {self.type(index).name}, not a note or rest")
+        pitch = self.pitches[row]
+        return (chr(pitch) if pitch else '', self.octaves[row], self.durations[row],
+                self.string(self.modifiers[row]) or '')
+
+    def walk(self) -> Iterator[Tuple[int, int]]:
+        """Yield (node index, depth) in preorder."""
+        ends = []
+        for index in range(len(self.types)):
+            while ends and ends[-1] <= index:
+                ends.pop()
+            yield index, len(ends)
+            ends.append(index + self.sizes[index])
+
+    def build(self, index: int) -> ASTNode:
+        node_type = NODE_TYPES[self.types[index]]
+        if node_type is NodeType.NOTE:
+            row = self.payloads[index]
+            modifiers = self.string(self.modifiers[row])
+            return NoteNode(chr(self.pitches[row]), self.octaves[row], self.durations[row],
+                            list(modifiers) if modifiers else None)
+        if node_type is NodeType.REST:
+            return RestNode(self.durations[self.payloads[index]])
+        if node_type is NodeType.BAR:
+            return BarNode()
+        value = self.value(index)
+        if node_type is NodeType.REPEAT:
+            node = RepeatNode()
+        elif node_type is NodeType.DYNAMIC:
+            node = DynamicNode(value)
+        elif node_type is NodeType.TEMPO:
+            node = TempoNode(int(value.split()[0]))
+        elif node_type is NodeType.BINARY_OP:
+            # Its NUMBER child is added by to_ast like any other
+            node = TransposeNode()
+        else:
+            node = ASTNode(node_type, value)
+        node.value = value
+        return node
+
+    def to_ast(self, index: int = 0) -> ASTNode:
+        """Rebuild the subtree rooted at `index` as ordinary AST nodes."""
+        sizes = self.sizes
+        build = self.build
+        root = build(index)
+        # (node, index one past its subtree) for the current ancestor chain
+        stack = [(root, index + sizes[index])]
+        for child in range(index + 1, index + sizes[index]):
+            while stack[-1][1] <= child:
+                stack.pop()
+            node = build(child)
+            stack[-1][0].add_child(node)
+            if sizes[child] > 1:
+                stack.append((node, child + sizes[child]))
+        return root
+
+def loads(data: bytes) -> ASTNode:
+    return ScoreFile(data).to_ast()
+
+def load(path: str) -> ASTNode:
+    with ScoreFile.open(path) as score:
+        return score.to_ast()
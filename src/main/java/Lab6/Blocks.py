@@ -0,0 +1,190 @@
+from typing import Dict, Generic, Iterable, Iterator, List, Optional, Sequence, Tuple, TypeVar, Union
+
+# A list whose slices can be replaced in time that depends on the size of the
+# slice, not of the list, for the incremental parser: a one-character edit in
+# a long score must not shift every later line, checkpoint and root child.
+
+T = TypeVar("T")
+
+# Blocks are split in two once they reach twice this size
+BLOCK_SIZE = 256
+
+class BlockList(Generic[T]):
+    """A sequence stored as a list of blocks.
+
+    A Fenwick tree over the block lengths finds the block holding an index in
+    O(log n), so reading an item or replacing a slice only touches the blocks
+    involved. Reads in order reuse the last block found and cost O(1).
+
+    With track=True the list also remembers which block holds each item (by
+    identity), so index() scans one block instead of the whole list. Items of
+    a tracked list must be distinct objects, as the children of a node are.
+    """
+    def __init__(self, items: Iterable[T] = (), track: bool = False):
+        self.blocks: List[List[T]] = []
+        self.tree: List[int] = [0]
+        self.size = 0
+        self.where: Optional[Dict[int, List[T]]] = {} if track else None
+        self.numbers: Dict[int, int] = {}  # id(block) -> its index in self.blocks
+        self.hint: Optional[Tuple[int, int]] = None  # (block, first index) of the last read
+        self.splice(0, 0, list(items))
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __iter__(self) -> Iterator[T]:
+        for block in self.blocks:
+            yield from block
+
+    def __reversed__(self) -> Iterator[T]:
+        for block in reversed(self.blocks):
+            yield from reversed(block)
+
+    def __getitem__(self, index: Union[int, slice]) -> Union[T, List[T]]:
+        if isinstance(index, slice):
+            return [self[position] for position in range(*index.indices(self.size))]
+        number, offset = self.locate(index)
+        return self.blocks[number][offset]
+
+    def __setitem__(self, index: Union[int, slice], value) -> None:
+        if isinstance(index, slice):
+            start, stop, step = index.indices(self.size)
+            if step != 1:
+                raise ValueError("BlockList only supports contiguous slices")
+            self.splice(start, max(start, stop), list(value))
+            return
+        number, offset = self.locate(index)
+        block = self.blocks[number]
+        if self.where is not None:
+            del self.where[id(block[offset])]
+            self.where[id(value)] = block
+        block[offset] = value
+
+    def __repr__(self) -> str:
+        return f"BlockList({list(self)!r})"
+
+    def append(self, item: T) -> None:
+        self.splice(self.size, self.size, [item])
+
+    def index(self, item: T, start: int = 0) -> int:
+        if self.where is None:
+            for position in range(start, self.size):
+                if self[position] is item or self[position] == item:
+                    return position
+            raise ValueError(f"{item!r} is not in list")
+        block = self.where.get(id(item))
+        if block is None:
+            raise ValueError(f"{item!r} is not in list")
+        number = self.numbers[id(block)]
+        position = self.offset(number) + next(offset for offset, other in enumerate(block)
+                                              if other is item)
+        if position < start:
+            raise ValueError(f"{item!r} is not in list after {start}")
+        return position
+
+    def splice(self, start: int, stop: int, items: Sequence[T]) -> None:
+        """Replace self[start:stop] with items."""
+        start = max(0, min(start, self.size))
+        stop = max(start, min(stop, self.size))
+        self.hint = None
+        emptied = False
+
+        if stop > start:
+            number, offset = self.locate(start)
+            remaining = stop - start
+            while remaining:
+                block = self.blocks[number]
+                removed = block[offset:offset + remaining]
+                del block[offset:offset + remaining]
+                if self.where is not None:
+                    for item in removed:
+                        del self.where[id(item)]
+                self.resize(number, -len(removed))
+                emptied = emptied or not block
+                remaining -= len(removed)
+                number, offset = number + 1, 0
+            self.size -= stop - start
+            if emptied:
+                self.blocks = [block for block in self.blocks if block]
+                self.rebuild()
+
+        if not items:
+            return
+        if not self.blocks:
+            self.blocks.append([])
+            self.rebuild()
+        if start == self.size:
+            number = len(self.blocks) - 1
+            offset = len(self.blocks[number])
+        else:
+            number, offset = self.locate(start)
+        block = self.blocks[number]
+        block[offset:offset] = items
+        self.size += len(items)
+        if self.where is not None:
+            for item in items:
+                self.where[id(item)] = block
+        if len(block) < 2 * BLOCK_SIZE:
+            self.resize(number, len(items))
+            return
+
+        pieces = [block[first:first + BLOCK_SIZE] for first in range(0, len(block), BLOCK_SIZE)]
+        self.blocks[number:number + 1] = pieces
+        if self.where is not None:
+            for piece in pieces:
+                for item in piece:
+                    self.where[id(item)] = piece
+        self.rebuild()
+
+    def locate(self, index: int) -> Tuple[int, int]:
+        """Block holding an index, and the index's offset in it."""
+        if index < 0:
+            index += self.size
+        if not 0 <= index < self.size:
+            raise IndexError("BlockList index out of range")
+        if self.hint is not None:
+            number, first = self.hint
+            end = first + len(self.blocks[number])
+            if first <= index < end:
+                return number, index - first
+            if number + 1 < len(self.blocks) and end <= index < end + len(self.blocks[number + 1]):
+                self.hint = (number + 1, end)
+                return number + 1, index - end
+
+        # Largest block number whose preceding blocks hold at most `index` items
+        tree = self.tree
+        number = first = 0
+        step = 1 << (len(tree).bit_length() - 1)
+        while step:
+            if number + step < len(tree) and first + tree[number + step] <= index:
+                number += step
+                first += tree[number]
+            step >>= 1
+        self.hint = (number, first)
+        return number, index - first
+
+    def offset(self, number: int) -> int:
+        # Items in the blocks before block `number`
+        total = 0
+        while number > 0:
+            total += self.tree[number]
+            number -= number & -number
+        return total
+
+    def resize(self, number: int, change: int) -> None:
+        number += 1
+        while number < len(self.tree):
+            self.tree[number] += change
+            number += number & -number
+
+    def rebuild(self) -> None:
+        # After blocks were split or dropped: O(number of blocks)
+        tree = [0] * (len(self.blocks) + 1)
+        for number, block in enumerate(self.blocks, 1):
+            tree[number] += len(block)
+            parent = number + (number & -number)
+            if parent < len(tree):
+                tree[parent] += tree[number]
+        self.tree = tree
+        self.numbers = {id(block): number for number, block in enumerate(self.blocks)}
+        self.hint = None
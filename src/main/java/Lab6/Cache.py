@@ -0,0 +1,160 @@
+import hashlib
+import os
+import tempfile
+import zlib
+from collections import OrderedDict
+from typing import Dict, Optional
+import Binary
+from AST import ASTNode
+from Parser import PARSER_VERSION
+
+# Part of every key, so entries written by another parser or format version
+# are simply never found
+KEY_PREFIX = f"v{PARSER_VERSION}.{Binary.FORMAT_VERSION}"
+
+class ParseCache:
+    """Content-addressed cache of parsed scores, in memory and optionally on disk.
+
+    Entries are keyed by a hash of the source text and KEY_PREFIX, so an edited
+    file or a parser change can never return a stale tree. List and streaming
+    parses give the same tree, so a file and its text share one entry. Trees
+    are stored in the Binary format, compressed; every hit returns a fresh
+    copy, which the caller is free to modify. Both tiers evict least recently
+    used entries once their size limit is exceeded.
+    """
+    SUFFIX = ".ast"
+
+    def __init__(self, directory: Optional[str] = None,
+                 memory_limit: int = 64 * 2**20, disk_limit: int = 1024 * 2**20):
+        self.directory = directory
+        self.memory_limit = memory_limit
+        self.disk_limit = disk_limit
+        self.memory: "OrderedDict[str, bytes]" = OrderedDict()
+        self.memory_size = 0
+        self.disk_size = 0
+        self.stats: Dict[str, int] = {
+            "hits": 0, "memory_hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0,
+        }
+
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+            self.disk_size = sum(entry.stat().st_size for entry in self.disk_entries())
+
+    @staticmethod
+    def key_for_source(source: str) -> str:
+        digest = hashlib.sha256(f"{KEY_PREFIX}\0".encode())
+        digest.update(source.encode())
+        return digest.hexdigest()
+
+    @staticmethod
+    def key_for_file(path: str, chunk_size: int = 2**20) -> str:
+        # Hashes the decoded text, so the key does not depend on line endings on disk
+        digest = hashlib.sha256(f"{KEY_PREFIX}\0".encode())
+        with open(path, 'r') as f:
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    break
+                digest.update(chunk.encode())
+        return digest.hexdigest()
+
+    def get(self, key: str) -> Optional[ASTNode]:
+        data = self.memory.get(key)
+        if data is not None:
+            self.memory.move_to_end(key)
+            self.stats["memory_hits"] += 1
+        else:
+            data = self.read_disk(key)
+            if data is None:
+                self.stats["misses"] += 1
+                return None
+            self.stats["disk_hits"] += 1
+            self.remember(key, data)
+
+        self.stats["hits"] += 1
+        return self.decode(data)
+
+    def put(self, key: str, ast: ASTNode) -> None:
+        data = self.encode(ast)
+        self.remember(key, data)
+        if self.directory is not None:
+            self.write_disk(key, data)
+
+    def clear(self) -> None:
+        self.memory.clear()
+        self.memory_size = 0
+        for entry in self.disk_entries():
+            self.remove(entry.path)
+        self.disk_size = 0
+
+    def encode(self, ast: ASTNode) -> bytes:
+        return zlib.compress(Binary.dumps(ast))
+
+    def decode(self, data: bytes) -> ASTNode:
+        return Binary.loads(zlib.decompress(data))
+
+    def remember(self, key: str, data: bytes) -> None:
+        previous = self.memory.pop(key, None)
+        if previous is not None:
+            self.memory_size -= len(previous)
+        self.memory[key] = data
+        self.memory_size += len(data)
+        while self.memory_size > self.memory_limit and self.memory:
+            _, evicted = self.memory.popitem(last=False)
+            self.memory_size -= len(evicted)
+            self.stats["evictions"] += 1
+
+    def path_for(self, key: str) -> str:
+        return os.path.join(self.directory, key + self.SUFFIX)
+
+    def disk_entries(self):
+        if self.directory is None:
+            return []
+        return [entry for entry in os.scandir(self.directory)
+                if entry.is_file() and entry.name.endswith(self.SUFFIX)]
+
+    def read_disk(self, key: str) -> Optional[bytes]:
+        if self.directory is None:
+            return None
+        path = self.path_for(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            os.utime(path)  # the modification time doubles as the LRU clock
+        except FileNotFoundError:
+            return None
+        return data
+
+    def write_disk(self, key: str, data: bytes) -> None:
+        path = self.path_for(key)
+        if os.path.exists(path):
+            os.utime(path)
+            return
+        # Write then rename, so concurrent workers never read a partial entry
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, path)
+        self.disk_size += len(data)
+        if self.disk_size > self.disk_limit:
+            self.evict_disk()
+
+    def evict_disk(self) -> None:
+        # Re-scan instead of trusting the running total, other processes may
+        # share the directory. Trim to 90% so evictions do not happen on every put.
+        entries = sorted(self.disk_entries(), key=lambda entry: entry.stat().st_mtime)
+        self.disk_size = sum(entry.stat().st_size for entry in entries)
+        target = self.disk_limit * 9 // 10
+        for entry in entries:
+            if self.disk_size <= target:
+                break
+            self.disk_size -= entry.stat().st_size
+            self.remove(entry.path)
+            self.stats["evictions"] += 1
+
+    @staticmethod
+    def remove(path: str) -> None:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,178 @@
+import io
+import os
+import random
+import time
+from typing import List, Tuple
+import Midi
+from Cache import ParseCache
+from Events import iter_events
+from Incremental import IncrementalScore
+from Log import Log, Verbosity
+from Main import Lexer, output_paths, process_source
+from Parser import Parser
+
+# Self-checks run by `python Main.py check`: each one raises AssertionError
+# with the offending input on the first failure and returns a one-line summary.
+
+QUIET = Log(Verbosity.QUIET)
+
+STATEMENTS = ["c4 8", "d", "e 16 .", "r 4", "f#", "g+", "a- 8 ~", "|", "|", "mf", "p",
+              "\\bpm 120", "\\transpose c4 d4", "\\transpose -3", "4", "\n"]
+
+def random_score(rng: random.Random, size: int = 40) -> str:
+    # Statements with |: and :| inserted in balanced pairs, nested at random
+    parts: List[str] = []
+    open_repeats = 0
+    for _ in range(rng.randint(0, size)):
+        roll = rng.random()
+        if roll < 0.1:
+            parts.append("|:")
+            open_repeats += 1
+        elif roll < 0.2 and open_repeats:
+            parts.append(":|")
+            open_repeats -= 1
+        else:
+            parts.append(rng.choice(STATEMENTS))
+    parts.extend([":|"] * open_repeats)
+    return " ".join(parts)
+
+def parse_list(source: str) -> str:
+    return str(Parser(Lexer(source, log=QUIET).scan_tokens(), log=QUIET).parse())
+
+def parse_stream(source: str) -> str:
+    tokens = Lexer(log=QUIET).iter_tokens(io.StringIO(source), chunk_size=7)
+    return str(Parser(tokens, log=QUIET).parse())
+
+def check_modes(count: int = 3000, seed: int = 0) -> str:
+    """List and streaming parses build the same tree."""
+    rng = random.Random(seed)
+    start = time.perf_counter()
+    for _ in range(count):
+        source = random_score(rng)
+        assert parse_list(source) == parse_stream(source), f"modes differ on {source!r}"
+    return f"modes: {count} scores parse the same as a list and as a stream " \
+           f"({time.perf_counter() - start:.3f} s)"
+
+# Source, then the pitches it plays
+REPEATS = [
+    ("|: c | d :| e | f", [60, 62, 60, 62, 64, 65]),  # bars after :| are played once
+    ("|: c |: d :| e :| f", [60, 62, 62, 64, 60, 62, 62, 64, 65]),
+    ("|: c | d :| e | f :|", [60, 62, 60, 62, 64, 65]),  # a stray :| closes nothing
+    ("c |: d", [60, 62]),                               # an unclosed repeat is played once
+]
+
+def check_repeats(seed: int = 0) -> str:
+    """Repeats play their bars twice and nothing after them, in both parse modes."""
+    for source, pitches in REPEATS:
+        for tokens in (Lexer(source, log=QUIET).scan_tokens(),
+                       Lexer(log=QUIET).iter_tokens(io.StringIO(source))):
+            played = [event.pitch for event in iter_events(Parser(tokens, log=QUIET).parse())]
+            assert played == pitches, f"{source!r} plays {played}, expected {pitches}"
+    return f"repeats: {len(REPEATS)} scores play the expected pitches"
+
+TRANSPOSITIONS = [
+    ("\\transpose c4 d4 c4 4", [62]),
+    ("\\transpose c#4 f4 c d", [64, 66]),        # accidental on the first pitch: +4
+    ("\\transpose f4# c5 c", [66]),              # accidental after the octave: +6
+    ("\\transpose c4 d4\ne 4", [66]),
+    ("\\transpose\nc d e f", [60, 62, 64, 65]),  # no interval on its line
+    ("\\transpose c\nd e", [60, 62, 64]),        # half a pair: nothing consumed
+    ("\\transpose -2 c | \\transpose ++ c | \\transpose 0 c", [58, 84, 60]),
+]
+
+def check_transpose(seed: int = 0) -> str:
+    """\\transpose intervals, in both parse modes."""
+    for source, pitches in TRANSPOSITIONS:
+        for tokens in (Lexer(source, log=QUIET).scan_tokens(),
+                       Lexer(log=QUIET).iter_tokens(io.StringIO(source))):
+            played = [event.pitch for event in iter_events(Parser(tokens, log=QUIET).parse())]
+            assert played == pitches, f"{source!r} plays {played}, expected {pitches}"
+    return f"transpose: {len(TRANSPOSITIONS)} scores play the expected pitches"
+
+# Source, then the (tick, beats per minute) of each tempo event in its MIDI file
+TEMPOS = [
+    ("c 4", [(0, 120)]),
+    ("\\bpm 60\nr 1 | c 4", [(0, 60)]),
+    ("c 4 \\bpm 60 r 1 d 4", [(0, 120), (480, 60)]),
+    ("c 1 \\bpm 90", [(0, 120), (1920, 90)]),
+    ("|: \\bpm 60 c 4 \\bpm 90 :| d", [(0, 60), (960, 90)]),
+    ("\\bpm 1 c 4", [(0, 4)]),  # held at the slowest tempo a file can store
+]
+
+def tempo_events(data: bytes) -> List[Tuple[int, int]]:
+    # Walks the single track of a file written by Midi.dumps
+    track = data[22:]
+    tempos = []
+    tick = index = 0
+    while index < len(track):
+        delta = 0
+        while track[index] & 0x80:
+            delta = (delta << 7) | (track[index] & 0x7F)
+            index += 1
+        tick += (delta << 7) | track[index]
+        index += 1
+        if track[index] == Midi.META:
+            kind, length = track[index + 1], track[index + 2]
+            if kind == Midi.META_TEMPO:
+                tempos.append((tick, round(60_000_000 / int.from_bytes(track[index + 3:index + 6], "big"))))
+            index += 3 + length
+        else:
+            index += 3 if track[index] & 0x80 else 2
+    return tempos
+
+def check_tempo(seed: int = 0) -> str:
+    """MIDI tempo changes are written at their own time."""
+    for source, tempos in TEMPOS:
+        written = tempo_events(Midi.dumps(Parser(Lexer(source, log=QUIET).scan_tokens(), log=QUIET).parse()))
+        assert written == tempos, f"{source!r} writes tempos {written}, expected {tempos}"
+    return f"tempo: {len(TEMPOS)} scores write the expected MIDI tempo events"
+
+def check_cache(seed: int = 0) -> str:
+    """A tree the cache cannot store is still returned as a successful parse."""
+    cache = ParseCache()
+    for source in ("c 4 d", "c 10000000000"):
+        for _ in range(2):
+            result = process_source(source, QUIET, cache)
+            assert result.error is None and result.ast is not None, \
+                f"{source!r} fails with a cache: {result.error}"
+    assert cache.stats["hits"] == 1, f"expected one cache hit, got {cache.stats}"
+    return "cache: parses succeed whether or not their tree can be cached"
+
+def check_outputs(seed: int = 0) -> str:
+    """Batch parses of files with the same name write their trees to different files."""
+    paths = ["songs/a/x.txt", "songs/b/x.txt", "songs/b/c/x.txt", "songs/b/y.txt"]
+    outputs = output_paths(paths, "out")
+    expected = [os.path.join("out", *path.split("/")[1:]) + ".ast.txt" for path in paths]
+    assert outputs == expected, f"trees of {paths} go to {outputs}"
+    assert output_paths(["songs/x.txt"], "out") == [os.path.join("out", "x.txt.ast.txt")]
+    return f"outputs: {len(paths)} files get {len(set(outputs))} different tree files"
+
+def edit_time(lines: int, edits: int = 40) -> float:
+    # Median time of a one-character edit, and of a newline typed and deleted,
+    # at lines spread through a score of one bar per line
+    score = IncrementalScore("\n".join("c d |" for _ in range(lines)), QUIET)
+    times = []
+    for count in range(edits):
+        line = count * 7919 % lines
+        for edit in ((line, 0, line, 1, "e"), (line, 2, line, 2, "\n"), (line, 2, line + 1, 0, "")):
+            start = time.perf_counter()
+            score.edit(*edit)
+            times.append(time.perf_counter() - start)
+    if lines <= 1000:
+        assert str(score.root) == parse_list(score.source), f"edits diverge on {lines} lines"
+    return sorted(times)[len(times) // 2]
+
+def check_incremental(seed: int = 0) -> str:
+    """An edit costs about the same in a long score as in a short one."""
+    short, long = edit_time(1_000), edit_time(100_000)
+    assert long < 10 * short, f"edit takes {long * 1e6:.0f} us on 100k lines, " \
+                              f"{short * 1e6:.0f} us on 1k"
+    return f"incremental: one edit takes {short * 1e6:.0f} us on 1k lines, " \
+           f"{long * 1e6:.0f} us on 100k"
+
+CHECKS = [check_modes, check_repeats, check_transpose, check_tempo, check_cache, check_outputs, check_incremental]
+
+def run_checks(seed: int = 0) -> int:
+    for check in CHECKS:
+        print(check(seed=seed))
+    return 0
@@ -0,0 +1,112 @@
+from math import gcd
+from typing import Iterator, List, NamedTuple, Optional
+from AST import ASTNode, DynamicNode, NoteNode, RepeatNode, RestNode, TempoNode, TransposeNode
+
+# Tempo and dynamic in effect before the score sets its own
+DEFAULT_BPM = 120
+DEFAULT_DYNAMIC = "mf"
+
+# A beat is a quarter note, and durations are fractions of a whole note
+BEATS_PER_WHOLE = 4
+
+# MIDI velocity per dynamic marking; unknown markings keep the current one
+VELOCITIES = {"ppp": 16, "pp": 33, "p": 49, "mp": 64, "mf": 80, "f": 96, "ff": 112, "fff": 127}
+
+class Event(NamedTuple):
+    onset: float             # beats from the start of the score
+    onset_seconds: float
+    duration: float          # beats
+    duration_seconds: float
+    pitch: int               # MIDI note number after any \\transpose, middle C (c4) is 60
+    velocity: int            # 1-127
+    bpm: int                 # tempo the note is played at
+
+class TempoChange(NamedTuple):
+    onset: float             # beats from the start of the score
+    bpm: int
+
+def tempo_bpm(node: TempoNode) -> int:
+    return int(node.value.split()[0])
+
+def repeat_count(node: RepeatNode) -> int:
+    # The value reads like "2x"
+    return int(node.value.rstrip("x"))
+
+def iter_events(root: ASTNode, bpm: int = DEFAULT_BPM,
+                dynamic: str = DEFAULT_DYNAMIC,
+                tempo_changes: Optional[List[TempoChange]] = None) -> Iterator[Event]:
+    """Yield the notes of a score in playing order, with their timing.
+
+    Repeats are played by walking their children again, not by copying them,
+    so nothing is unrolled and nested repeats cost no memory. A tempo or
+    dynamic inside a repeat takes effect again on every pass. Rests only
+    move time forward. A \\transpose holds until the next one, which
+    replaces it rather than adding to it.
+
+    If a tempo_changes list is given, the starting tempo and every change
+    are appended to it as they are reached, so a change is in the list
+    before any note that starts at or after it is yielded. A MIDI file needs
+    them at their own time, not just on the next note.
+
+    Time is counted exactly from the notes' exact_duration fractions, and
+    the floats of every event are derived from that count, so rounding
+    error does not build up over a long score.
+    """
+    # Time so far is position / scale whole notes; scale grows to a common
+    # denominator of the lengths seen. Seconds count from the last tempo change.
+    position = 0
+    scale = 1
+    tempo_position = 0
+    tempo_seconds = 0.0
+    seconds_per_whole = 60 * BEATS_PER_WHOLE
+    velocity = VELOCITIES[dynamic]
+    transpose = 0
+    if tempo_changes is not None:
+        tempo_changes.append(TempoChange(0.0, bpm))
+
+    # [children, next index, passes left] per section being walked
+    stack = [[root.children, 0, 1]]
+    while stack:
+        frame = stack[-1]
+        children, index, passes = frame
+        if index == len(children):
+            if passes > 1:
+                frame[1] = 0
+                frame[2] = passes - 1
+            else:
+                stack.pop()
+            continue
+        frame[1] = index + 1
+
+        node = children[index]
+        if isinstance(node, (NoteNode, RestNode)):
+            numerator = node.exact_duration.numerator
+            denominator = node.exact_duration.denominator
+            if isinstance(node, NoteNode):
+                yield Event(position * BEATS_PER_WHOLE / scale,
+                            tempo_seconds + (position - tempo_position) * seconds_per_whole / (scale * bpm),
+                            numerator * BEATS_PER_WHOLE / denominator,
+                            numerator * seconds_per_whole / (denominator * bpm),
+                            node.midi + transpose, velocity, bpm)
+            if scale % denominator:
+                factor = denominator // gcd(scale, denominator)
+                scale *= factor
+                position *= factor
+                tempo_position *= factor
+            position += numerator * (scale // denominator)
+        elif isinstance(node, TempoNode):
+            new_bpm = tempo_bpm(node)
+            if new_bpm:  # \bpm 0 is ignored
+                tempo_seconds += (position - tempo_position) * seconds_per_whole / (scale * bpm)
+                tempo_position = position
+                bpm = new_bpm
+                if tempo_changes is not None:
+                    tempo_changes.append(TempoChange(position * BEATS_PER_WHOLE / scale, bpm))
+        elif isinstance(node, DynamicNode):
+            velocity = VELOCITIES.get(node.value, velocity)
+        elif isinstance(node, TransposeNode):
+            transpose = node.semitones
+        elif isinstance(node, RepeatNode):
+            stack.append([node.children, 0, repeat_count(node)])
+        elif node.children:
+            stack.append([node.children, 0, 1])
@@ -0,0 +1,289 @@
+from dataclasses import dataclass
+from typing import Iterator, List, NamedTuple, Optional, Tuple
+from AST import NO_CHILDREN, ASTNode, BarNode, NodeType
+from Blocks import BlockList
+from Log import Log, Verbosity
+from Main import Lexer
+from Parser import Parser
+from Tokens import Token, TokenType
+
+class Checkpoint(NamedTuple):
+    """Parser state at the start of a line, when it is safe to resume there.
+
+    A line only gets one if the parser reached its first token at top level,
+    with the root as current section; the rest of the parse then depends on
+    nothing but these fields and the tokens that follow. Positions are kept
+    as nodes rather than indices, so they stay valid when earlier lines change.
+    """
+    anchor: Optional[ASTNode]      # last child of the root at that point
+    bar: Optional[BarNode]         # the open bar, if any
+    bar_anchor: Optional[ASTNode]  # last child of that bar at that point
+
+@dataclass
+class EditResult:
+    lines_lexed: int     # lines lexed again
+    first_line: int      # line the parse resumed from
+    lines_parsed: int    # lines whose tokens went through the parser again
+    resynced: bool       # False when the parse had to run to the end of the score
+
+class IncrementalScore:
+    """A parsed score that can be edited without lexing and parsing it again.
+
+    The source is kept as lines, each with its own tokens (no token spans a
+    newline), and the parse records a Checkpoint per line. After an edit only
+    the touched lines are lexed. Parsing resumes from the last checkpoint
+    before the edit and stops at the first line after it where the new parse
+    is in the same state as the old one; the nodes in between are spliced
+    into the existing SCORE root, and the notes of the open bar into that
+    bar. Parsing is done in streaming mode. An edit that closes a bar early
+    or merges two bars also moves the notes of the bars involved.
+
+    Lines inside a repeat have no checkpoint, so an edit there re-parses up
+    to the line after its :|, or to the end of the score if it is never closed.
+    """
+    def __init__(self, source: str, log: Optional[Log] = None):
+        self.log = log or Log(Verbosity.WARNING)
+        # Per-line state and the children of the root are block lists, so an
+        # edit costs about the same in a long score as in a short one
+        self.lines = BlockList(source.split("\n"))
+        self.line_tokens = BlockList(self.lex_line(index, line) for index, line in enumerate(self.lines))
+        self.root = ASTNode(NodeType.SCORE)
+        self.root.children = BlockList(track=True)
+        self.checkpoints: BlockList[Optional[Checkpoint]] = BlockList()
+        self.reparse(0, Checkpoint(None, None, None), len(self.lines), 0)
+
+    @property
+    def source(self) -> str:
+        return "\n".join(self.lines)
+
+    def tokens(self) -> Iterator[Token]:
+        yield from self.tokens_from(0)
+        yield Token(TokenType.EOF, None, len(self.lines))
+
+    def lex_line(self, index: int, line: str) -> List[Tuple[TokenType, str]]:
+        lexer = Lexer(line, log=self.log)
+        lexer.line = index + 1
+        lexer.scan()
+        # Line numbers are attached when tokens are replayed, so inserting or
+        # deleting lines does not make the stored tokens stale
+        return [(token.type, token.value) for token in lexer.tokens]
+
+    def tokens_from(self, first_line: int) -> Iterator[Token]:
+        for index in range(first_line, len(self.lines)):
+            for token_type, value in self.line_tokens[index]:
+                yield Token(token_type, value, index + 1)
+
+    def edit(self, start_line: int, start_column: int, end_line: int, end_column: int,
+             text: str) -> EditResult:
+        """Replace the text between two (line, column) positions, both 0-based."""
+        if not (0 <= start_line <= end_line < len(self.lines)):
+            raise IndexError(f"Edit range {start_line}-{end_line} is outside the score")
+
+        new_lines = (self.lines[start_line][:start_column] + text
+                     + self.lines[end_line][end_column:]).split("\n")
+        self.lines[start_line:end_line + 1] = new_lines
+        self.line_tokens[start_line:end_line + 1] = [
+            self.lex_line(start_line + offset, line) for offset, line in enumerate(new_lines)
+        ]
+
+        # A checkpoint was taken with the parser looking at the first token after
+        # it (a note takes its octave and duration from the next line too), so it
+        # is only usable if that token comes before the edit
+        first_line = start_line - 1
+        while first_line > 0 and (self.checkpoints[first_line] is None
+                                  or not self.line_tokens[first_line]):
+            first_line -= 1
+        first_line = max(first_line, 0)
+        shift = len(new_lines) - (end_line - start_line + 1)
+        return self.reparse(first_line, self.checkpoints[first_line],
+                            start_line + len(new_lines), shift, len(new_lines))
+
+    def index_after(self, anchor: Optional[ASTNode]) -> int:
+        return 0 if anchor is None else self.root.children.index(anchor) + 1
+
+    def reparse(self, first_line: int, start: Checkpoint, resync_line: int, shift: int,
+                lines_lexed: int = 0) -> EditResult:
+        """Parse from first_line until the state matches the old parse again.
+
+        Lines from resync_line on are unchanged and sit `shift` lines further
+        down than before the edit.
+        """
+        line_starts = {}  # line -> index of its first token in this parse
+
+        def feed() -> Iterator[Token]:
+            position = 0
+            for index in range(first_line, len(self.lines)):
+                tokens = self.line_tokens[index]
+                if tokens:
+                    line_starts[index] = position
+                    position += len(tokens)
+                    for token_type, value in tokens:
+                        yield Token(token_type, value, index + 1)
+
+        parser = Parser(feed(), log=self.log)
+        # The bar open at the checkpoint already holds notes from earlier lines,
+        # which the new parse must not touch: it fills a stand-in instead, whose
+        # notes are moved into the real bar afterwards
+        stand_in = BarNode() if start.bar is not None else None
+        parser.current_bar = stand_in
+
+        # One entry per line from first_line on, filled in as the parser reaches them
+        checkpoints: List[Optional[Checkpoint]] = []
+
+        resynced_at = None
+        while True:
+            token = parser.peek()
+            line = token.line - 1 if token.type != TokenType.EOF else len(self.lines)
+            next_line = first_line + len(checkpoints)
+            if line >= next_line:
+                # Lines up to `line` are now behind the parser. Only those with no
+                # tokens of their own between the previous token and this one
+                # start exactly here.
+                previous_line = parser.previous().line - 1 if parser.current else first_line - 1
+                if token.type == TokenType.EOF:
+                    # Reaching the end settles unclosed repeats, which can change how
+                    # earlier lines parsed; only an untouched parser may resume here
+                    at_line_start = parser.current == 0
+                else:
+                    at_line_start = parser.current == line_starts[line]
+                state = self.state(parser, start, stand_in) if at_line_start else None
+                for index in range(next_line, min(line + 1, len(self.lines))):
+                    checkpoints.append(state if index > previous_line else None)
+
+                if state is not None and token.type != TokenType.EOF:
+                    for index in range(max(next_line, previous_line + 1, resync_line), line + 1):
+                        old = self.checkpoints[index - shift]
+                        if old is not None and (old.bar is None) == (state.bar is None):
+                            resynced_at = index
+                            break
+                    if resynced_at is not None:
+                        del checkpoints[resynced_at - first_line + 1:]
+                        break
+
+            if token.type == TokenType.EOF:
+                break
+            parser.step()
+
+        begin = self.index_after(start.anchor)
+        if resynced_at is None:
+            parser.finish()
+            old = None
+            end = len(self.root.children)
+            old_end = len(self.checkpoints)
+        else:
+            old = self.checkpoints[resynced_at - shift]
+            end = self.index_after(old.anchor)
+            old_end = resynced_at - shift + 1
+        new_children = list(parser.root.children)
+
+        # Open bars at the resync point: the new one and the old one, which also
+        # holds the notes of the unchanged lines after it
+        pending = parser.current_bar if old is not None else None
+        if old is not None and old.bar is not None:
+            cut = self.bar_index(old.bar, old.bar_anchor)
+        # The old open bar is closed inside the edited lines now, so the notes
+        # it collected after the resync point move to the new open bar
+        moves_tail = stand_in is not None and old is not None and old.bar is start.bar \
+            and pending is not stand_in
+        if moves_tail:
+            tail = old.bar.children[cut:]
+
+        if stand_in is not None:
+            start_cut = self.bar_index(start.bar, start.bar_anchor)
+            if pending is stand_in and old.bar is start.bar:
+                # Still the same bar at both ends: only its middle changed
+                self.splice(start.bar, start_cut, cut, stand_in.children)
+            elif pending is stand_in:
+                # The bar is no longer closed inside the edited lines: it takes over
+                # the one that was open at the resync point, earlier lines included
+                self.splice(old.bar, 0, cut, [*start.bar.children[:start_cut], *stand_in.children])
+                self.rename_bar(checkpoints, start.bar, old.bar)
+                index = first_line - 1
+                while index >= 0 and (self.checkpoints[index] is None
+                                      or self.checkpoints[index].bar is start.bar):
+                    if self.checkpoints[index] is not None:
+                        self.checkpoints[index] = self.checkpoints[index]._replace(bar=old.bar)
+                    index -= 1
+            else:
+                self.splice(start.bar, start_cut, len(start.bar.children), stand_in.children)
+                for child in start.bar.children:
+                    child._parent = start.bar
+                if stand_in in new_children:
+                    new_children[new_children.index(stand_in)] = start.bar
+
+        if pending is not None and pending is not stand_in:
+            if moves_tail:
+                self.splice(pending, len(pending.children), len(pending.children), tail)
+                try:
+                    index = self.root.children.index(old.bar, end)
+                    self.root.children[index] = pending
+                    pending._parent = self.root
+                except ValueError:
+                    pass
+            else:
+                self.splice(old.bar, 0, cut, pending.children)
+                self.rename_bar(checkpoints, pending, old.bar)
+
+        self.splice(self.root, begin, end, new_children)
+        self.checkpoints[first_line:old_end] = checkpoints
+
+        if resynced_at is not None:
+            # Lines after the resync point that still sit right behind the
+            # replaced nodes must point at their replacement instead
+            synced = checkpoints[-1]
+            for index in range(resynced_at + 1, len(self.checkpoints)):
+                checkpoint = self.checkpoints[index]
+                if checkpoint is None:
+                    continue
+                anchor, bar, bar_anchor = checkpoint
+                if anchor is old.anchor:
+                    anchor = synced.anchor
+                elif moves_tail and anchor is old.bar:
+                    anchor = pending
+                if bar is not None and bar is old.bar:
+                    if bar_anchor is old.bar_anchor:
+                        bar_anchor = synced.bar_anchor
+                    if moves_tail:
+                        bar = pending
+                updated = Checkpoint(anchor, bar, bar_anchor)
+                if updated == checkpoint:
+                    break
+                self.checkpoints[index] = updated
+
+        last_line = resynced_at if resynced_at is not None else len(self.lines)
+        return EditResult(lines_lexed, first_line, last_line - first_line, resynced_at is not None)
+
+    @staticmethod
+    def state(parser: Parser, start: Checkpoint,
+              stand_in: Optional[BarNode]) -> Optional[Checkpoint]:
+        if parser.repeat_depth or parser.current_section is not parser.root:
+            return None
+        anchor = parser.root.children[-1] if parser.root.children else start.anchor
+        if anchor is stand_in:
+            anchor = start.bar
+        bar = parser.current_bar
+        if bar is None:
+            return Checkpoint(anchor, None, None)
+        if bar is stand_in:
+            return Checkpoint(anchor, start.bar,
+                              stand_in.children[-1] if stand_in.children else start.bar_anchor)
+        return Checkpoint(anchor, bar, bar.children[-1] if bar.children else None)
+
+    @staticmethod
+    def bar_index(bar: BarNode, anchor: Optional[ASTNode]) -> int:
+        return 0 if anchor is None else bar.children.index(anchor) + 1
+
+    @staticmethod
+    def splice(parent: ASTNode, start: int, stop: int, nodes: List[ASTNode]) -> None:
+        for node in nodes:
+            node._parent = parent
+        if parent.children is NO_CHILDREN:
+            parent.children = []
+        parent.children[start:stop] = nodes
+
+    @staticmethod
+    def rename_bar(checkpoints: List[Optional[Checkpoint]], bar: BarNode,
+                   replacement: BarNode) -> None:
+        for index, checkpoint in enumerate(checkpoints):
+            if checkpoint is not None and checkpoint.bar is bar:
+                checkpoints[index] = checkpoint._replace(bar=replacement)
@@ -0,0 +1,40 @@
+import sys
+from enum import IntEnum
+from typing import Optional, TextIO
+
+class Verbosity(IntEnum):
+    QUIET = 0      # No output at all
+    WARNING = 1    # Lexer warnings and errors
+    INFO = 2       # Phase banners, timings and the finished tree
+    TRACE = 3      # Every token and every node (slow on large scores)
+
+class Log:
+    """Verbosity-filtered output for the lexer, parser and front end.
+
+    Hot loops should test `enabled()` once, before the loop, and skip both
+    the formatting and the call when the level is off.
+    """
+    def __init__(self, level: Verbosity = Verbosity.INFO, sink: Optional[TextIO] = None):
+        self.level = level
+        self._sink = sink
+
+    @property
+    def sink(self) -> TextIO:
+        # Resolved on use, so redirecting sys.stdout also redirects the default sink
+        return self._sink if self._sink is not None else sys.stdout
+
+    def enabled(self, level: Verbosity) -> bool:
+        return self.level >= level
+
+    def emit(self, level: Verbosity, message: str) -> None:
+        if self.level >= level:
+            self.sink.write(message + "\n")
+
+    def warning(self, message: str) -> None:
+        self.emit(Verbosity.WARNING, message)
+
+    def info(self, message: str) -> None:
+        self.emit(Verbosity.INFO, message)
+
+    def trace(self, message: str) -> None:
+        self.emit(Verbosity.TRACE, message)
@@ -1,26 +1,163 @@
+import argparse
 import os
+import sys
 import time
-from typing import List
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass
+from typing import Iterable, Iterator, List, Optional, Sequence, TextIO
 from Tokens import Token, TokenType
+from Log import Log, Verbosity
+from Cache import ParseCache
+import Midi
+from Events import Event, TempoChange, iter_events
 from Parser import Parser
 from AST import ASTNode, NodeType, NoteNode, RestNode, BarNode, RepeatNode, DynamicNode, TempoNode
 import re
 
 class Lexer:
-    def __init__(self, source: str):
+    # Scanning engines: "classic" walks the source one character at a time,
+    # "regex" matches whole tokens with a single precompiled pattern.
+    ENGINES = ("classic", "regex")
+    
+    # One alternative per token shape, tried in the same order as the
+    # if/elif chain in scan_token so both engines agree on every input.
+    MASTER_PATTERN = re.compile(r"""
+        (?P<NOTE>[a-g])
+      | (?P<REST>r)
+      | (?P<SHARP>\#)
+      | (?P<NUMBER>[0-9]+)
+      | (?P<OCTAVE_UP>\+)
+      | (?P<OCTAVE_DOWN>-)
+      | (?P<DOT>\.)
+      | (?P<TRIPLET>~)
+      | (?P<REPEAT_START>\|:)
+      | (?P<BAR>\|)
+      | (?P<REPEAT_END>:\|)
+      | (?P<COLON>:)
+      | (?P<DYNAMIC>[pm][A-Za-z]*)
+      | (?P<COMMAND>\\[A-Za-z0-9_]*)
+      | (?P<SKIP>[ \t\r]+)
+      | (?P<NEWLINE>\n)
+      | (?P<UNEXPECTED>.)
+    """, re.VERBOSE | re.DOTALL)
+    
+    # Groups whose token value is simply the matched text
+    SIMPLE_GROUPS = {
+        "NOTE": TokenType.NOTE,
+        "REST": TokenType.REST,
+        "SHARP": TokenType.SHARP,
+        "OCTAVE_UP": TokenType.OCTAVE_UP,
+        "OCTAVE_DOWN": TokenType.OCTAVE_DOWN,
+        "DOT": TokenType.DOT,
+        "TRIPLET": TokenType.TRIPLET,
+        "REPEAT_START": TokenType.REPEAT_START,
+        "BAR": TokenType.BAR,
+        "REPEAT_END": TokenType.REPEAT_END,
+        "DYNAMIC": TokenType.DYNAMIC,
+    }
+    
+    # Characters requested from the stream per read in iter_tokens
+    CHUNK_SIZE = 64 * 1024
+    
+    def __init__(self, source: str = "", engine: str = "regex", log: Optional[Log] = None):
+        if engine not in self.ENGINES:
+            raise ValueError(f"Unknown lexer engine '{engine}', expected one of {self.ENGINES}")
         self.source = source
+        self.engine = engine
+        self.log = log or Log()
         self.tokens: List[Token] = []
         self.start = 0
         self.current = 0
         self.line = 1
     
     def scan_tokens(self) -> List[Token]:
+        self.scan()
+        self.tokens.append(Token(TokenType.EOF, None, self.line))
+        return self.tokens
+    
+    def iter_tokens(self, stream: TextIO, chunk_size: int = CHUNK_SIZE) -> Iterator[Token]:
+        """Lex a text stream chunk by chunk, yielding tokens as they are found.
+        
+        Only the current chunk and the unfinished token at its end are held in
+        memory, so the input can be arbitrarily large.
+        """
+        self.source = ""
+        self.current = 0
+        while True:
+            chunk = stream.read(chunk_size)
+            # Carry over whatever the previous chunk could not finish
+            self.source = self.source[self.current:] + chunk
+            self.start = self.current = 0
+            self.tokens = []
+            self.scan(final=not chunk)
+            yield from self.tokens
+            if not chunk:
+                break
+        
+        self.tokens = []
+        yield Token(TokenType.EOF, None, self.line)
+    
+    def scan(self, final: bool = True):
+        """Scan self.source from self.current.
+        
+        With final=False the input is a prefix of a longer text: a token that
+        touches the end of the source may continue in the next chunk, so it is
+        left unscanned and self.current stops at its first character.
+        """
+        # The master pattern spells character classes in ASCII; str.isdigit and
+        # friends accept more than that, so anything else takes the classic path.
+        if self.engine == "regex" and self.source.isascii():
+            self.scan_regex(final)
+        else:
+            self.scan_classic(final)
+    
+    def scan_classic(self, final: bool = True):
         while not self.is_at_end():
             self.start = self.current
+            count = len(self.tokens)
             self.scan_token()
+            if (not final and self.is_at_end()
+                    and (len(self.tokens) > count or self.source[self.start] == ':')):
+                del self.tokens[count:]
+                self.current = self.start
+                break
+    
+    def scan_regex(self, final: bool = True):
+        source = self.source
+        append = self.tokens.append
+        simple = self.SIMPLE_GROUPS
+        line = self.line
+        end = len(source)
+        stop = end
+        warn = self.log.enabled(Verbosity.WARNING)
         
-        self.tokens.append(Token(TokenType.EOF, None, self.line))
-        return self.tokens
+        for m in self.MASTER_PATTERN.finditer(source, self.current):
+            kind = m.lastgroup
+            if not final and m.end() == end and kind not in ("SKIP", "NEWLINE", "UNEXPECTED"):
+                stop = m.start()
+                break
+            if kind in simple:
+                append(Token(simple[kind], m.group(), line))
+            elif kind == "SKIP":
+                pass
+            elif kind == "NEWLINE":
+                line += 1
+            elif kind == "NUMBER":
+                number = m.group()
+                if number[-1] == '0':
+                    append(Token(TokenType.OCTAVE, number, line))
+                else:
+                    append(Token(TokenType.DURATION, number, line))
+            elif kind == "COMMAND":
+                text = m.group()
+                append(Token(TokenType.COMMAND, text[1:] or text, line))
+            elif kind == "UNEXPECTED":
+                if warn:
+                    self.log.warning(f"Warning: Unexpected character '{m.group()}' at line {line}")
+            # A lone ':' is dropped, as in scan_token
+        
+        self.line = line
+        self.start = self.current = stop
     
     def scan_token(self):
         c = self.advance()
@@ -74,8 +211,8 @@ class Lexer:
             pass
         elif c == '\n':
             self.line += 1
-        else:
-            print(f"Warning: Unexpected character '{c}' at line {self.line}")
+        elif self.log.enabled(Verbosity.WARNING):
+            self.log.warning(f"Warning: Unexpected character '{c}' at line {self.line}")
     
     def number(self):
         while self.peek().isdigit():
@@ -128,39 +265,311 @@ class Lexer:
     def previous(self) -> str:
         return self.source[self.current - 1]
 
-def process_source(source: str):
-    start_time = time.time()
+@dataclass
+class ParseResult:
+    ast: Optional[ASTNode]
+    lex_time: Optional[float]  # None when lexing ran interleaved with parsing
+    parse_time: float
+    total_time: float
+    error: Optional[str] = None
+
+def report_error(log: Log, error: Exception) -> str:
+    if isinstance(error, SyntaxError):
+        message = f"Syntax Error: {error}"
+    else:
+        message = f"Unexpected Error: {error}"
+    log.warning(f"\033[1;31m{message}\033[0m")
+    if not isinstance(error, SyntaxError) and log.enabled(Verbosity.WARNING):
+        import traceback
+        traceback.print_exc(file=log.sink)
+    return message
+
+def report_tree(log: Log, ast: ASTNode, parse_time: float):
+    if not log.enabled(Verbosity.INFO):
+        return
+    log.info(f"\n\033[1;35m=== Parsing Complete in {parse_time:.3f} seconds ===\033[0m")
+    log.info("\n\033[1;35m=== Abstract Syntax Tree ===\033[0m")
+    # Written line by line, so huge trees are never built as one string
+    ast.write(log.sink)
+    log.info("")
+
+def process_source(source: str, log: Optional[Log] = None,
+                   cache: Optional[ParseCache] = None) -> ParseResult:
+    log = log or Log()
+    start_time = time.perf_counter()
+    
+    key = None
+    if cache is not None:
+        key = cache.key_for_source(source)
+        ast = cache.get(key)
+        if ast is not None:
+            return report_cached(log, ast, start_time)
     
-    print("\n\033[1;35m=== Starting Lexical Analysis ===\033[0m")
-    lexer = Lexer(source)
+    log.info("\n\033[1;35m=== Starting Lexical Analysis ===\033[0m")
+    lexer = Lexer(source, log=log)
     tokens = lexer.scan_tokens()
-    lex_time = time.time() - start_time
-    print(f"Lexical analysis completed in {lex_time:.3f} seconds")
+    lex_time = time.perf_counter() - start_time
+    log.info(f"Lexical analysis completed in {lex_time:.3f} seconds")
     
-    print("\n\033[1;35m=== Tokens Generated ===\033[0m")
-    for token in tokens:
-        print(token)
+    if log.enabled(Verbosity.TRACE):
+        log.trace("\n\033[1;35m=== Tokens Generated ===\033[0m")
+        for token in tokens:
+            log.trace(str(token))
     
-    print("\n\033[1;35m=== Starting Parsing ===\033[0m")
-    parse_start = time.time()
-    parser = Parser(tokens)
+    log.info("\n\033[1;35m=== Starting Parsing ===\033[0m")
+    parse_start = time.perf_counter()
+    parser = Parser(tokens, log=log)
     try:
         ast = parser.parse()
-        parse_time = time.time() - parse_start
-        print(f"\n\033[1;35m=== Parsing Complete in {parse_time:.3f} seconds ===\033[0m")
-        print("\n\033[1;35m=== Abstract Syntax Tree ===\033[0m")
-        if ast is None:
-            print("Error: Parser returned None")
-        else:
-            print(str(ast))
-        total_time = time.time() - start_time
-        print(f"\nTotal processing time: {total_time:.3f} seconds")
-    except SyntaxError as e:
-        print(f"\033[1;31mSyntax Error: {e}\033[0m")
     except Exception as e:
-        print(f"\033[1;31mUnexpected Error: {e}\033[0m")
-        import traceback
-        traceback.print_exc()
+        message = report_error(log, e)
+        now = time.perf_counter()
+        return ParseResult(None, lex_time, now - parse_start, now - start_time, message)
+    parse_time = time.perf_counter() - parse_start
+    if cache is not None:
+        cache_tree(log, cache, key, ast)
+    report_tree(log, ast, parse_time)
+    total_time = time.perf_counter() - start_time
+    log.info(f"\nTotal processing time: {total_time:.3f} seconds")
+    return ParseResult(ast, lex_time, parse_time, total_time)
+
+def cache_tree(log: Log, cache: ParseCache, key: str, ast: ASTNode) -> None:
+    # The parse succeeded whether or not the cache can hold its tree
+    try:
+        cache.put(key, ast)
+    except (ValueError, OSError) as e:
+        log.warning(f"Parse result not cached: {e}")
+
+def report_cached(log: Log, ast: ASTNode, start_time: float) -> ParseResult:
+    load_time = time.perf_counter() - start_time
+    log.info("\n\033[1;35m=== Loaded AST from cache ===\033[0m")
+    report_tree(log, ast, 0.0)
+    return ParseResult(ast, 0.0, 0.0, load_time)
+
+def echo_tokens(tokens: Iterator[Token], log: Log) -> Iterator[Token]:
+    for token in tokens:
+        log.trace(str(token))
+        yield token
+
+def process_file(filename: str, log: Optional[Log] = None,
+                 cache: Optional[ParseCache] = None) -> ParseResult:
+    """Lex and parse a score file as a stream, without reading it into memory."""
+    log = log or Log()
+    start_time = time.perf_counter()
+    
+    key = None
+    if cache is not None:
+        key = cache.key_for_file(filename)
+        ast = cache.get(key)
+        if ast is not None:
+            return report_cached(log, ast, start_time)
+    
+    log.info("\n\033[1;35m=== Streaming Lexical Analysis and Parsing ===\033[0m")
+    with open(filename, 'r') as f:
+        tokens = Lexer(log=log).iter_tokens(f)
+        if log.enabled(Verbosity.TRACE):
+            tokens = echo_tokens(tokens, log)
+        parser = Parser(tokens, log=log)
+        try:
+            ast = parser.parse()
+        except Exception as e:
+            message = report_error(log, e)
+            elapsed = time.perf_counter() - start_time
+            return ParseResult(None, None, elapsed, elapsed, message)
+    parse_time = time.perf_counter() - start_time
+    if cache is not None:
+        cache_tree(log, cache, key, ast)
+    report_tree(log, ast, parse_time)
+    return ParseResult(ast, None, parse_time, parse_time)
+
+@dataclass
+class FileResult:
+    path: str
+    size: int                     # bytes read
+    nodes: int                    # AST nodes, root included
+    parse_time: float
+    output: Optional[str] = None  # where the rendered tree was written
+    error: Optional[str] = None
+
+def count_nodes(root: ASTNode) -> int:
+    count = 0
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        count += 1
+        stack.extend(node.children)
+    return count
+
+def output_paths(paths: List[str], out_dir: str) -> List[str]:
+    """Where the tree of each file is written.
+
+    Each input's path relative to the directory all of them share is
+    mirrored under out_dir, so a/x.txt and b/x.txt do not overwrite each other.
+    """
+    sources = [os.path.abspath(path) for path in paths]
+    try:
+        base = os.path.commonpath([os.path.dirname(source) for source in sources]) if sources else ""
+    except ValueError:
+        base = ""  # different drives: keep each whole path, less the drive
+    outputs = []
+    for source in sources:
+        relative = os.path.relpath(source, base) if base else os.path.splitdrive(source)[1].lstrip(os.sep)
+        outputs.append(os.path.join(out_dir, relative + ".ast.txt"))
+    return outputs
+
+def parse_file_job(path: str, output: Optional[str] = None,
+                   cache_dir: Optional[str] = None) -> FileResult:
+    """Parse one file quietly; runs inside a worker process of parse_many."""
+    try:
+        size = os.path.getsize(path)
+        cache = worker_cache(cache_dir)
+        result = process_file(path, Log(Verbosity.QUIET), cache)
+        if result.error:
+            return FileResult(path, size, 0, result.parse_time, error=result.error)
+        
+        if output is not None:
+            os.makedirs(os.path.dirname(output), exist_ok=True)
+            with open(output, 'w') as f:
+                result.ast.write(f)
+        return FileResult(path, size, count_nodes(result.ast), result.parse_time, output)
+    except Exception as e:
+        return FileResult(path, 0, 0, 0.0, error=f"{type(e).__name__}: {e}")
+
+# One cache per worker process and directory, reused across jobs
+worker_caches = {}
+
+def worker_cache(cache_dir: Optional[str]) -> Optional[ParseCache]:
+    if cache_dir is None:
+        return None
+    if cache_dir not in worker_caches:
+        worker_caches[cache_dir] = ParseCache(cache_dir)
+    return worker_caches[cache_dir]
+
+def parse_many(paths: Iterable[str], jobs: Optional[int] = None,
+               out_dir: Optional[str] = None, cache_dir: Optional[str] = None) -> Iterator[FileResult]:
+    """Parse many score files over a process pool.
+    
+    Results are yielded in completion order, not input order. Per-file
+    failures come back as results with `error` set instead of raising.
+    jobs=1 parses in this process, which is easier to debug.
+    """
+    paths = list(paths)
+    outputs = output_paths(paths, out_dir) if out_dir is not None else [None] * len(paths)
+    if jobs == 1:
+        for path, output in zip(paths, outputs):
+            yield parse_file_job(path, output, cache_dir)
+        return
+    
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = [executor.submit(parse_file_job, path, output, cache_dir)
+                   for path, output in zip(paths, outputs)]
+        for future in as_completed(futures):
+            yield future.result()
+
+def run_batch(paths: List[str], jobs: Optional[int], out_dir: Optional[str],
+              cache_dir: Optional[str] = None) -> int:
+    if out_dir is not None:
+        os.makedirs(out_dir, exist_ok=True)
+    
+    start_time = time.perf_counter()
+    files = errors = total_bytes = 0
+    for result in parse_many(paths, jobs, out_dir, cache_dir):
+        files += 1
+        total_bytes += result.size
+        if result.error:
+            errors += 1
+            print(f"error {result.path}: {result.error}")
+        else:
+            print(f"ok    {result.path} ({result.nodes} nodes, {result.parse_time:.3f} s)")
+    
+    elapsed = time.perf_counter() - start_time
+    rate = files / elapsed if elapsed else 0.0
+    mb_rate = total_bytes / 2**20 / elapsed if elapsed else 0.0
+    print(f"\n{files} files ({errors} failed), {total_bytes / 2**20:.2f} MiB in {elapsed:.3f} s: "
+          f"{rate:.1f} files/s, {mb_rate:.2f} MiB/s")
+    return 1 if errors else 0
+
+def export_events(events: Iterable[Event], output: str,
+                  tempo_changes: Sequence[TempoChange] = ()) -> str:
+    """Write events to a .wav or .mid file; returns a summary of what was written."""
+    extension = os.path.splitext(output)[1].lower()
+    if extension == ".wav":
+        # Imported here so the rest of the front end runs without NumPy
+        import Audio
+        frames = Audio.render_events(events, output)
+        return f"{frames / Audio.SAMPLE_RATE:.1f} s of audio"
+    data = Midi.dumps_events(events, tempo_changes)
+    with open(output, 'wb') as f:
+        f.write(data)
+    return f"{len(data)} bytes of MIDI"
+
+def transposed_path(output: str, semitones: int) -> str:
+    # song.mid -> song.+2.mid
+    stem, extension = os.path.splitext(output)
+    return f"{stem}.{semitones:+d}{extension}"
+
+def run_export(path: str, output: str, transpositions: Optional[List[int]] = None) -> int:
+    extension = os.path.splitext(output)[1].lower()
+    if extension not in (".wav", ".mid", ".midi"):
+        print(f"error {output}: unknown output format '{extension}', expected .wav or .mid")
+        return 1
+    result = process_file(path, Log(Verbosity.QUIET))
+    if result.error:
+        print(f"error {path}: {result.error}")
+        return 1
+    
+    # Filled in by iter_events as the score is walked; every transposition shares it
+    tempo_changes: List[TempoChange] = []
+    played = iter_events(result.ast, tempo_changes=tempo_changes)
+    if not transpositions:
+        jobs = [(output, played)]
+    else:
+        import Transpose
+        streams = Transpose.transposed_events(played, transpositions)
+        if len(transpositions) == 1:
+            jobs = [(output, next(streams))]
+        else:
+            jobs = zip([transposed_path(output, shift) for shift in transpositions], streams)
+    
+    start_time = time.perf_counter()
+    for target, events in jobs:
+        summary = export_events(events, target, tempo_changes)
+        print(f"ok    {target} ({summary}, {time.perf_counter() - start_time:.3f} s)")
+        start_time = time.perf_counter()
+    return 0
+
+def cli(argv: List[str]) -> int:
+    if not argv:
+        main()
+        return 0
+    
+    arg_parser = argparse.ArgumentParser(prog="Main.py", description="Music notation parser")
+    commands = arg_parser.add_subparsers(dest="command", required=True)
+    parse_command = commands.add_parser("parse", help="parse score files in parallel")
+    parse_command.add_argument("files", nargs="+")
+    parse_command.add_argument("--jobs", "-j", type=int, default=None,
+                               help="worker processes (default: CPU count)")
+    parse_command.add_argument("--out", default=None,
+                               help="directory to write each rendered tree to")
+    parse_command.add_argument("--cache", default=None,
+                               help="directory of cached parses, reused across runs")
+    export_command = commands.add_parser("export", help="render a score to a .wav or .mid file")
+    export_command.add_argument("file")
+    export_command.add_argument("output")
+    export_command.add_argument("--transpose", "-t", type=int, nargs="+", default=None,
+                                metavar="SEMITONES",
+                                help="shift every note; with several shifts, one file each "
+                                     "(song.mid -> song.+2.mid)")
+    check_command = commands.add_parser("check", help="run the parser's self-checks")
+    check_command.add_argument("--seed", type=int, default=0)
+    args = arg_parser.parse_args(argv)
+    if args.command == "export":
+        return run_export(args.file, args.output, args.transpose)
+    if args.command == "check":
+        # Imported here, Checks imports this module
+        import Checks
+        return Checks.run_checks(args.seed)
+    return run_batch(args.files, args.jobs, args.out, args.cache)
 
 def show_help():
     print("\n\033[1;36m=== Music Notation Help ===\033[0m")
@@ -182,6 +591,8 @@ def show_help():
     print("  mf - Mezzo-forte (medium loud)")
     print("\n\033[1;33mCommands:\033[0m")
     print("  \\bpm 120 - Set tempo to 120 BPM")
+    print("  \\transpose +2 - Play the notes that follow 2 semitones higher")
+    print("  \\transpose c4 d4 - Same, from one pitch to another")
     print("\n\033[1;33mExample:\033[0m")
     print("  \\bpm 120")
     print("  mf")
@@ -200,6 +611,8 @@ def get_input_with_suggestions(prompt: str, suggestions: List[str]) -> str:
     return input("\033[1;32mYour choice: \033[0m")
 
 def main():
+    # The interactive parser is a teaching tool: show every step
+    log = Log(Verbosity.TRACE)
     while True:
         print("\033[1;36m=== Music Notation Parser ===\033[0m")
         print("\033[1;33m1. Parse from file")
@@ -219,9 +632,7 @@ def main():
             filename = get_input_with_suggestions("Enter filename:", suggestions)
             try:
                 # Try to open the file in the current directory
-                with open(filename, 'r') as f:
-                    source = f.read()
-                process_source(source)
+                process_file(filename, log)
             except FileNotFoundError:
                 print(f"\033[1;31mFile '{filename}' not found in current directory!\033[0m")
                 print("Available files:")
@@ -280,7 +691,7 @@ mf
                     lines.append(line)
                 source = "\n".join(lines)
             
-            process_source(source)
+            process_source(source, log)
         
         elif choice == "3":
             show_help()
@@ -293,4 +704,4 @@ mf
             print("\033[1;31mInvalid choice!\033[0m")
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    sys.exit(cli(sys.argv[1:])) 
\ No newline at end of file
@@ -0,0 +1,127 @@
+import heapq
+import struct
+from typing import Iterable, List, Sequence
+from AST import ASTNode
+from Events import Event, TempoChange, iter_events
+
+TICKS_PER_BEAT = 480
+
+NOTE_ON = 0x90
+META = 0xFF
+META_TEMPO = 0x51
+META_END_OF_TRACK = 0x2F
+
+# Tempo is stored as microseconds per beat in three bytes
+MAX_TEMPO = 0xFFFFFF
+
+def varint(value: int) -> bytes:
+    # Seven bits per byte, most significant first, high bit set on all but the last
+    groups = []
+    while value:
+        groups.append(value & 0x7F)
+        value >>= 7
+    if not groups:
+        return b"\0"
+    return bytes([group | 0x80 for group in reversed(groups[1:])] + [groups[0]])
+
+# Delta times are nearly always short, so their encodings are looked up
+SHORT_VARINTS = [varint(value) for value in range(1 << 14)]
+
+def write_varint(out: bytearray, value: int) -> None:
+    out += SHORT_VARINTS[value] if value < 1 << 14 else varint(value)
+
+def tempo_bytes(bpm: int) -> bytes:
+    # Very slow tempos do not fit in three bytes and are held at the slowest that does
+    return min(60_000_000 // max(bpm, 1), MAX_TEMPO).to_bytes(3, "big")
+
+def encode_track(events: Iterable[Event], tempo_changes: Sequence[TempoChange] = ()) -> bytearray:
+    """Encode events as the body of one MIDI track.
+
+    Everything goes straight into a single bytearray. Note offs are written
+    as note ons with velocity 0, so the whole track shares one running
+    status byte; the only other state is a heap of the notes still sounding.
+
+    Tempo changes are written at their own time. The list may still be
+    growing while the events are read, as iter_events fills it. Without one,
+    a change of tempo is written with the first note played at it.
+    """
+    track = bytearray()
+    tick = 0           # time of the last message written
+    status = None      # running status: the last channel status byte written
+    bpm = None
+    sounding = []      # heap of (end tick, pitch)
+    next_change = 0    # first entry of tempo_changes not written yet
+
+    def write_tempo(at: int, new_bpm: int) -> None:
+        nonlocal tick, status, bpm
+        if new_bpm == bpm:
+            return
+        bpm = new_bpm
+        write_varint(track, at - tick)
+        tick = at
+        track.extend((META, META_TEMPO, 3))
+        track.extend(tempo_bytes(bpm))
+        status = None  # meta events cancel running status
+
+    def change_tempo_until(limit: float) -> None:
+        nonlocal next_change
+        while next_change < len(tempo_changes):
+            at = round(tempo_changes[next_change].onset * TICKS_PER_BEAT)
+            if at > limit:
+                return
+            next_change += 1
+            # Only the last of several changes at the same time counts
+            if next_change < len(tempo_changes) \
+                    and round(tempo_changes[next_change].onset * TICKS_PER_BEAT) == at:
+                continue
+            release_until(at)
+            write_tempo(at, tempo_changes[next_change - 1].bpm)
+
+    def release_until(limit: int) -> None:
+        nonlocal tick, status
+        while sounding and sounding[0][0] <= limit:
+            end, pitch = heapq.heappop(sounding)
+            write_varint(track, end - tick)
+            tick = end
+            if status != NOTE_ON:
+                track.append(NOTE_ON)
+                status = NOTE_ON
+            track.append(pitch)
+            track.append(0)
+
+    for event in events:
+        if not 0 <= event.pitch <= 127:
+            continue
+        start = round(event.onset * TICKS_PER_BEAT)
+        end = round((event.onset + event.duration) * TICKS_PER_BEAT)
+        change_tempo_until(start)
+        release_until(start)
+        write_tempo(start, event.bpm)
+
+        write_varint(track, start - tick)
+        tick = start
+        if status != NOTE_ON:
+            track.append(NOTE_ON)
+            status = NOTE_ON
+        track.append(event.pitch)
+        track.append(max(1, min(127, event.velocity)))
+        heapq.heappush(sounding, (max(end, start + 1), event.pitch))
+
+    change_tempo_until(float("inf"))
+    release_until(float("inf"))
+    track += bytes((0, META, META_END_OF_TRACK, 0))
+    return track
+
+def dumps_events(events: Iterable[Event], tempo_changes: Sequence[TempoChange] = ()) -> bytes:
+    """A complete format 0 Standard MIDI File holding the events."""
+    track = encode_track(events, tempo_changes)
+    header = struct.pack(">4sIHHH", b"MThd", 6, 0, 1, TICKS_PER_BEAT)
+    return header + struct.pack(">4sI", b"MTrk", len(track)) + track
+
+def dumps(root: ASTNode) -> bytes:
+    tempo_changes: List[TempoChange] = []
+    return dumps_events(iter_events(root, tempo_changes=tempo_changes), tempo_changes)
+
+def write(root: ASTNode, path: str) -> None:
+    with open(path, 'wb') as f:
+        f.write(dumps(root))
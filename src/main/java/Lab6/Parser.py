@@ -1,75 +1,162 @@
-from typing import List, Optional
+from collections import deque
+from fractions import Fraction
+from typing import Iterable, List, Optional, Tuple, Union
 from AST import *
+from Log import Log, Verbosity
+from Tables import midi_number, note_duration
 from Tokens import Token, TokenType
 
+# Bump whenever the trees produced for the same source change; cached
+# parses from other versions are then ignored
+PARSER_VERSION = 5
+
+WHOLE = Fraction(1)
+
+class TokenWindow:
+    """List-style access to a token iterator through a small ring buffer.
+    
+    Indices are absolute positions in the token stream, but only the newest
+    `size` tokens stay addressable - enough for the parser's peek/previous.
+    """
+    def __init__(self, tokens: Iterable[Token], size: int = 8):
+        self._tokens = iter(tokens)
+        self._buffer = deque(maxlen=size)
+        self._end = 0  # absolute index one past the newest buffered token
+        self._eof: Optional[Token] = None
+    
+    def __getitem__(self, index: int) -> Token:
+        while index >= self._end:
+            if self._eof is not None:
+                return self._eof
+            token = next(self._tokens, None)
+            if token is None:
+                # The iterator ran dry without an EOF token; pretend it sent one
+                line = self._buffer[-1].line if self._buffer else 1
+                token = Token(TokenType.EOF, None, line)
+            if token.type == TokenType.EOF:
+                self._eof = token
+            self._buffer.append(token)
+            self._end += 1
+        
+        offset = index - (self._end - len(self._buffer))
+        if offset < 0:
+            raise IndexError(f"Token {index} is no longer buffered")
+        return self._buffer[offset]
+
 class Parser:
-    def __init__(self, tokens: List[Token]):
-        self.tokens = tokens
+    def __init__(self, tokens: Union[List[Token], Iterable[Token]], log: Optional[Log] = None):
+        # A list is indexed directly; any other iterable is parsed as a stream
+        # with bounded lookahead. The parser never looks further back or ahead
+        # than that, so both give the same tree.
+        self.streaming = not isinstance(tokens, list)
+        self.tokens = TokenWindow(tokens) if self.streaming else tokens
         self.current = 0
         self.root = ASTNode(NodeType.SCORE)
+        # The root, then every repeat opened and not yet closed, innermost last
+        self.sections: List[ASTNode] = [self.root]
         self.current_section = self.root
         self.current_bar = None
+        self.log = log or Log()
+        # Checked once here so the per-token paths below do no formatting at all
+        # unless tracing is on
+        self.tracing = self.log.enabled(Verbosity.TRACE)
     
     def parse(self) -> ASTNode:
-        print("Building AST...")
+        self.log.info("Building AST...")
         while not self.is_at_end():
-            node = self.parse_statement()
-            if node:
-                print(f"Added node: {node.type.name}")
-                if isinstance(node, BarNode):
-                    if self.current_bar:
-                        self.current_section.add_child(self.current_bar)
-                    self.current_bar = node
-                elif isinstance(node, (DynamicNode, TempoNode)):
-                    if self.current_bar:
-                        self.current_section.add_child(self.current_bar)
-                        self.current_bar = None
-                    self.root.add_child(node)
-                elif isinstance(node, (NoteNode, RestNode)):
-                    if self.current_bar:
-                        self.current_bar.add_child(node)
-                    else:
-                        self.current_bar = BarNode()
-                        self.current_bar.add_child(node)
-                elif isinstance(node, RepeatNode):
-                    if self.current_bar:
-                        self.current_section.add_child(self.current_bar)
-                        self.current_bar = None
-                    self.root.add_child(node)
-                    self.current_section = node
-            else:
-                self.advance()
+            self.step()
+        self.finish()
+        self.log.info("AST construction complete")
+        return self.root
+    
+    @property
+    def repeat_depth(self) -> int:
+        return len(self.sections) - 1
+    
+    def step(self) -> None:
+        """Parse one statement and attach it to the tree."""
+        if self.match(TokenType.REPEAT_START):
+            if self.tracing:
+                self.log.trace("Parsing repeat section...")
+            self.open_repeat()
+            return
+        if self.match(TokenType.REPEAT_END):
+            self.close_repeat()
+            return
         
+        node = self.parse_statement()
+        if node:
+            if self.tracing:
+                self.log.trace(f"Added node: {node.type.name}")
+            if isinstance(node, BarNode):
+                self.close_bar()
+                self.current_bar = node
+            elif isinstance(node, (NoteNode, RestNode)):
+                if self.current_bar:
+                    self.current_bar.add_child(node)
+                else:
+                    self.current_bar = BarNode()
+                    self.current_bar.add_child(node)
+            elif isinstance(node, (DynamicNode, TempoNode, TransposeNode)):
+                self.close_bar()
+                self.current_section.add_child(node)
+            # Any other command is left out of the tree
+        else:
+            self.advance()
+    
+    def finish(self) -> None:
+        self.close_bar()
+        # A repeat still open at the end was never closed: its content stays
+        # where it is, played once
+        while self.repeat_depth:
+            repeat_node = self.sections.pop()
+            self.current_section = self.sections[-1]
+            for child in repeat_node.children:
+                self.current_section.add_child(child)
+    
+    def close_bar(self) -> None:
         if self.current_bar:
             self.current_section.add_child(self.current_bar)
-        
-        print("AST construction complete")
-        return self.root
+            self.current_bar = None
+    
+    def open_repeat(self) -> None:
+        # Attached to the enclosing section when it is closed
+        self.close_bar()
+        self.current_section = RepeatNode()
+        self.sections.append(self.current_section)
+    
+    def close_repeat(self) -> None:
+        if not self.repeat_depth:
+            return  # a :| with no |: is ignored
+        self.close_bar()
+        repeat_node = self.sections.pop()
+        self.current_section = self.sections[-1]
+        self.current_section.add_child(repeat_node)
     
     def parse_statement(self) -> Optional[ASTNode]:
         if self.match(TokenType.NOTE):
-            print("Parsing note...")
+            if self.tracing:
+                self.log.trace("Parsing note...")
             return self.parse_note()
         elif self.match(TokenType.REST):
-            print("Parsing rest...")
+            if self.tracing:
+                self.log.trace("Parsing rest...")
             return self.parse_rest()
         elif self.match(TokenType.BAR):
-            print("Parsing bar...")
+            if self.tracing:
+                self.log.trace("Parsing bar...")
             return BarNode()
-        elif self.match(TokenType.REPEAT_START):
-            print("Parsing repeat section...")
-            repeat_node = self.parse_repeat()
-            self.current_section = self.root
-            self.current_bar = None
-            return repeat_node
         elif self.match(TokenType.DYNAMIC):
-            print(f"Parsing dynamic: {self.previous().value}")
+            if self.tracing:
+                self.log.trace(f"Parsing dynamic: {self.previous().value}")
             return DynamicNode(self.previous().value)
         elif self.match(TokenType.COMMAND):
-            print(f"Parsing command: {self.previous().value}")
+            if self.tracing:
+                self.log.trace(f"Parsing command: {self.previous().value}")
             return self.parse_command()
         elif self.match(TokenType.DURATION):  # Handle standalone duration tokens
-            print(f"Skipping standalone duration: {self.previous().value}")
+            if self.tracing:
+                self.log.trace(f"Skipping standalone duration: {self.previous().value}")
             return None
         return None
     
@@ -77,7 +164,7 @@ class Parser:
         token = self.previous()
         pitch = token.value
         octave = 4  # default octave
-        duration = 1.0  # default duration
+        duration, exact = 1.0, WHOLE  # default duration
         modifiers = []
         
         # Parse octave
@@ -90,81 +177,122 @@ class Parser:
         
         # Parse duration
         if self.match(TokenType.DURATION):
-            duration = 1.0 / int(self.previous().value)
-            if self.match(TokenType.DOT):
-                duration *= 1.5
-            if self.match(TokenType.TRIPLET):
-                duration *= 2/3
+            duration, exact = self.parse_duration()
         
         # Parse modifiers
         while self.match(TokenType.SHARP) or self.match(TokenType.FLAT):
             modifiers.append(self.previous().value)
         
-        return NoteNode(pitch, octave, duration, modifiers)
+        return NoteNode(pitch, octave, duration, modifiers, exact)
     
     def parse_rest(self) -> RestNode:
-        duration = 1.0  # default duration
+        duration, exact = 1.0, WHOLE  # default duration
         
         if self.match(TokenType.DURATION):
-            duration = 1.0 / int(self.previous().value)
-            if self.match(TokenType.DOT):
-                duration *= 1.5
-            if self.match(TokenType.TRIPLET):
-                duration *= 2/3
+            duration, exact = self.parse_duration()
         
-        return RestNode(duration)
+        return RestNode(duration, exact)
     
-    def parse_repeat(self) -> RepeatNode:
-        repeat_node = RepeatNode()
-        previous_section = self.current_section
-        previous_bar = self.current_bar
-        self.current_section = repeat_node
-        self.current_bar = None
+    def parse_duration(self) -> Tuple[float, Fraction]:
+        # The DURATION token was just matched; dot and triplet marks follow it
+        value = self.previous().value
+        dotted = self.match(TokenType.DOT)
+        triplet = self.match(TokenType.TRIPLET)
+        return note_duration(value, dotted, triplet)
+    
+    def parse_command(self) -> ASTNode:
+        # The lexer drops the backslash; a number ending in 0 lexes as OCTAVE
+        command = self.previous().value
+        if command in ("bpm", "\\bpm"):
+            if self.match(TokenType.DURATION) or self.match(TokenType.OCTAVE):
+                return TempoNode(int(self.previous().value))
+            # Left out of the tree like any other command, so a score being
+            # typed in (see Incremental) still parses
+            self.log.warning(f"Warning: Expected BPM value after \\bpm at line {self.previous().line}")
+        elif command in ("transpose", "\\transpose"):
+            transpose = self.parse_transpose()
+            if transpose is not None:
+                return transpose
+            self.log.warning(f"Warning: Expected an interval after \\transpose at line {self.previous().line}")
+        return ASTNode(NodeType.COMMAND, command)
+    
+    def parse_transpose(self) -> Optional[TransposeNode]:
+        # \transpose +5 / -5 / 5   semitones
+        # \transpose + / --         octaves, one per sign
+        # \transpose c4 d4          from one pitch to another (+2)
+        # The interval has to be on the line of the \transpose. A pitch pair is
+        # only consumed once both pitches are there, so an incomplete one
+        # leaves the notes after the command alone.
+        line = self.previous().line
+        first = self.pitch_length(0, line)
+        second = self.pitch_length(first, line) if first else 0
+        if second:
+            start = self.parse_pitch(first)
+            return TransposeNode(self.parse_pitch(second) - start)
         
-        # Keep track of tokens to detect unclosed repeat
-        start_pos = self.current
+        signs = []
+        while self.peek().line == line and (self.match(TokenType.OCTAVE_UP)
+                                             or self.match(TokenType.OCTAVE_DOWN)):
+            signs.append(1 if self.previous().type == TokenType.OCTAVE_UP else -1)
+        if self.peek().line == line and (self.match(TokenType.DURATION)
+                                         or self.match(TokenType.OCTAVE)):
+            # The last sign belongs to the number, any before it are octaves
+            sign = signs.pop() if signs else 1
+            return TransposeNode(12 * sum(signs) + sign * int(self.previous().value))
+        if signs:
+            return TransposeNode(12 * sum(signs))
+        return None
+    
+    # Tokens a pitch pair may span; with the token before it, this is all a
+    # streaming parser keeps buffered
+    PITCH_LOOKAHEAD = 7
+    
+    def pitch_length(self, offset: int, line: int) -> int:
+        """Tokens in the pitch `offset` tokens ahead (0 if there is none), without consuming any.
         
-        while not self.match(TokenType.REPEAT_END):
-            if self.is_at_end():
-                # If we reach the end without finding a repeat end, 
-                # rewind to the start of the repeat and parse as normal
-                self.current = start_pos
-                self.current_section = previous_section
-                self.current_bar = previous_bar
+        A pitch is a NOTE followed, in any order, by at most one octave - a
+        number, as in c4, or a + / - - and any accidentals.
+        """
+        def token_at(length: int) -> Optional[Token]:
+            if offset + length >= self.PITCH_LOOKAHEAD:
                 return None
-            
-            node = self.parse_statement()
-            if node:
-                if isinstance(node, BarNode):
-                    if self.current_bar:
-                        self.current_section.add_child(self.current_bar)
-                    self.current_bar = node
-                elif isinstance(node, (NoteNode, RestNode)):
-                    if self.current_bar:
-                        self.current_bar.add_child(node)
-                    else:
-                        self.current_bar = BarNode()
-                        self.current_bar.add_child(node)
-                else:
-                    self.current_section.add_child(node)
-            else:
-                self.advance()
+            token = self.lookahead(offset + length)
+            return token if token.line == line else None
         
-        # Add any remaining bar in the repeat section
-        if self.current_bar:
-            self.current_section.add_child(self.current_bar)
-        
-        self.current_section = previous_section
-        self.current_bar = previous_bar
-        return repeat_node
+        token = token_at(0)
+        if token is None or token.type != TokenType.NOTE:
+            return 0
+        length = 1
+        octave = False
+        while True:
+            token = token_at(length)
+            if token is None:
+                return length
+            if token.type in (TokenType.SHARP, TokenType.FLAT):
+                length += 1
+            elif not octave and token.type in (TokenType.OCTAVE, TokenType.DURATION,
+                                               TokenType.OCTAVE_UP, TokenType.OCTAVE_DOWN):
+                octave = True
+                length += 1
+            else:
+                return length
     
-    def parse_command(self) -> ASTNode:
-        command = self.previous().value
-        if command == "\\bpm":
-            if not self.match(TokenType.DURATION):
-                raise SyntaxError("Expected BPM value after \\bpm command")
-            return TempoNode(int(self.previous().value))
-        return ASTNode(NodeType.COMMAND, command)
+    def parse_pitch(self, length: int) -> int:
+        # Consumes the `length` tokens counted by pitch_length
+        tokens = [self.advance() for _ in range(length)]
+        pitch = tokens[0].value
+        octave = 4
+        modifiers = []
+        for token in tokens[1:]:
+            if token.type in (TokenType.OCTAVE, TokenType.DURATION):
+                octave = int(token.value)
+            elif token.type == TokenType.OCTAVE_UP:
+                octave += 1
+            elif token.type == TokenType.OCTAVE_DOWN:
+                octave -= 1
+            else:
+                modifiers.append(token.value)
+        return midi_number(pitch, octave, tuple(modifiers))
     
     def match(self, *types: TokenType) -> bool:
         for type in types:
@@ -189,5 +317,12 @@ class Parser:
     def peek(self) -> Token:
         return self.tokens[self.current]
     
+    def lookahead(self, offset: int) -> Token:
+        # The token `offset` places after the current one, EOF past the end
+        index = self.current + offset
+        if not self.streaming and index >= len(self.tokens):
+            return self.tokens[-1]
+        return self.tokens[index]
+    
     def previous(self) -> Token:
         return self.tokens[self.current - 1] 
\ No newline at end of file
@@ -0,0 +1,77 @@
+from fractions import Fraction
+from typing import Dict, Tuple
+
+# Lookup tables shared by the parser and the AST, so a note's MIDI number and
+# exact length cost one dict lookup instead of fresh arithmetic per note.
+# They are filled once, for the usual range, by fill_tables(); anything else
+# is computed each time and not kept, so odd input cannot make them grow.
+
+PITCH_CLASSES = {"c": 0, "d": 2, "e": 4, "f": 5, "g": 7, "a": 9, "b": 11}
+ACCIDENTALS = {"#": 1, "b": -1}
+
+# Largest denominator expected when a float duration (e.g. from a binary
+# score file) is turned back into a fraction
+MAX_DENOMINATOR = 1 << 20
+
+PitchKey = Tuple[str, int, Tuple[str, ...]]
+DurationKey = Tuple[str, bool, bool]
+
+MIDI_NUMBERS: Dict[PitchKey, int] = {}
+DURATIONS: Dict[DurationKey, Tuple[float, Fraction]] = {}
+EXACT_DURATIONS: Dict[float, Fraction] = {}
+
+def midi_number(pitch: str, octave: int, modifiers: Tuple[str, ...] = ()) -> int:
+    """MIDI number of a note; middle C (c4) is 60."""
+    number = MIDI_NUMBERS.get((pitch, octave, modifiers))
+    if number is None:
+        number = (octave + 1) * 12 + PITCH_CLASSES[pitch]
+        for modifier in modifiers:
+            number += ACCIDENTALS.get(modifier, 0)
+    return number
+
+FREQUENCIES = tuple(440.0 * 2.0 ** ((number - 69) / 12.0) for number in range(128))
+
+def frequency(number: int) -> float:
+    if 0 <= number < 128:
+        return FREQUENCIES[number]
+    return 440.0 * 2.0 ** ((number - 69) / 12.0)
+
+def note_duration(value: str, dotted: bool = False, triplet: bool = False) -> Tuple[float, Fraction]:
+    """(float, exact) length in whole notes of a DURATION token and its dot/triplet marks.
+
+    The float is computed exactly as the parser always did, so trees print
+    the same as before.
+    """
+    entry = DURATIONS.get((value, dotted, triplet))
+    if entry is None:
+        duration = 1.0 / int(value)
+        exact = Fraction(1, int(value))
+        if dotted:
+            duration *= 1.5
+            exact *= Fraction(3, 2)
+        if triplet:
+            duration *= 2/3
+            exact *= Fraction(2, 3)
+        entry = (duration, exact)
+    return entry
+
+def exact_duration(duration: float) -> Fraction:
+    """The fraction a float duration stands for, e.g. 1/12 for 0.08333... (a triplet eighth)."""
+    exact = EXACT_DURATIONS.get(duration)
+    if exact is None:
+        exact = Fraction(duration).limit_denominator(MAX_DENOMINATOR)
+    return exact
+
+def fill_tables() -> None:
+    for pitch in PITCH_CLASSES:
+        for octave in range(-1, 10):
+            for modifiers in ((), ("#",), ("b",)):
+                MIDI_NUMBERS[(pitch, octave, modifiers)] = midi_number(pitch, octave, modifiers)
+    for value in range(1, 65):
+        for dotted in (False, True):
+            for triplet in (False, True):
+                key = (str(value), dotted, triplet)
+                duration, exact = DURATIONS[key] = note_duration(*key)
+                EXACT_DURATIONS.setdefault(duration, exact)
+
+fill_tables()
@@ -0,0 +1,85 @@
+from typing import Iterable, Iterator, List, Sequence, Tuple, Union
+import numpy as np
+from AST import ASTNode, NoteNode
+from Events import Event
+from Tables import ACCIDENTALS, PITCH_CLASSES
+
+# Transposition of whole scores. The pitches of all notes are packed into one
+# integer array, so a shift - or a shift into every key at once - is a single
+# array operation; NoteNode objects are only touched by apply(), to spell the
+# results back into a tree.
+
+# Spelling of each pitch class. Sharps only: the lexer reads every 'b' as the
+# note b, so a flat could not be parsed back.
+SPELLINGS = (("c", ()), ("c", ("#",)), ("d", ()), ("d", ("#",)), ("e", ()), ("f", ()),
+             ("f", ("#",)), ("g", ()), ("g", ("#",)), ("a", ()), ("a", ("#",)), ("b", ()))
+
+Shifts = Union[int, Sequence[int], np.ndarray]
+
+def key_interval(source: str, target: str) -> int:
+    """Smallest shift (-6 to +5 semitones) from one key to another, e.g. ("c", "f#")."""
+    def pitch_class(key: str) -> int:
+        key = key.lower()
+        if not key or key[0] not in PITCH_CLASSES:
+            raise ValueError(f"Unknown key '{key}'")
+        return PITCH_CLASSES[key[0]] + sum(ACCIDENTALS.get(mark, 0) for mark in key[1:])
+
+    shift = (pitch_class(target) - pitch_class(source)) % 12
+    return shift - 12 if shift > 5 else shift
+
+def note_nodes(root: ASTNode) -> List[NoteNode]:
+    """Every note of the score in written order; repeats are not expanded."""
+    notes = []
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, NoteNode):
+            notes.append(node)
+        elif node.children:
+            stack.extend(reversed(node.children))
+    return notes
+
+def pack(notes: Sequence[NoteNode]) -> np.ndarray:
+    return np.fromiter((note.midi for note in notes), dtype=np.int32, count=len(notes))
+
+def transpose(pitches: np.ndarray, semitones: Shifts = 0, octaves: Shifts = 0) -> np.ndarray:
+    """Shift packed pitches.
+
+    With a single shift the result has the shape of `pitches`. With a
+    sequence of shifts it has one row per shift, so every key of a practice
+    set comes out of one broadcast addition.
+    """
+    shifts = np.asarray(semitones, dtype=np.int32) + 12 * np.asarray(octaves, dtype=np.int32)
+    pitches = np.asarray(pitches, dtype=np.int32)
+    if shifts.ndim == 0:
+        return pitches + shifts
+    return pitches[np.newaxis, :] + shifts.reshape(-1, 1)
+
+def apply(notes: Sequence[NoteNode], pitches: np.ndarray) -> None:
+    """Respell each note so it sounds at the pitch in the same position."""
+    octaves, classes = np.divmod(pitches, 12)
+    for note, pitch, pitch_class, octave in zip(notes, pitches.tolist(), classes.tolist(),
+                                                (octaves - 1).tolist()):
+        note.pitch, note.modifiers = SPELLINGS[pitch_class]
+        note.octave = octave
+        note.midi = pitch
+
+def transpose_score(root: ASTNode, semitones: int = 0, octaves: int = 0) -> None:
+    """Transpose the written notes of a score in place."""
+    notes = note_nodes(root)
+    apply(notes, transpose(pack(notes), semitones, octaves))
+
+def pack_events(events: Iterable[Event]) -> Tuple[List[Event], np.ndarray]:
+    events = list(events)
+    return events, np.fromiter((event.pitch for event in events), dtype=np.int32, count=len(events))
+
+def with_pitches(events: Sequence[Event], pitches: np.ndarray) -> Iterator[Event]:
+    """The events again, each playing the pitch in the same position instead."""
+    for event, pitch in zip(events, pitches.tolist()):
+        yield event._replace(pitch=pitch)
+
+def transposed_events(events: Iterable[Event], shifts: Sequence[int]) -> Iterator[Iterator[Event]]:
+    """One event stream per shift; timing is computed once for all of them."""
+    events, pitches = pack_events(events)
+    for row in transpose(pitches, list(shifts)):
+        yield with_pitches(events, row)